@@ -0,0 +1,101 @@
+"""
+Local stand-in for the BAS runG2P web service, speaks the same XML/download-link protocol so g2p.AsyncG2PClient can
+be pointed at it instead of the real service:
+
+    python bas_standin.py 8000
+    g2p.AsyncG2PClient("http://127.0.0.1:8000/services/runG2P")
+
+Every character of a line is "transcribed" to itself, which keeps the output aligned with the input.
+"""
+import email.parser
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LANGUAGES = ["deu", "eng-US", "eng-GB", "fra", "ita", "nld", "spa"]
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<WebServiceResponseLink>
+<success>{success}</success>
+<downloadLink>{download_link}</downloadLink>
+<output>{output}</output>
+<warnings></warnings>
+</WebServiceResponseLink>"""
+
+
+def transcribe(line: str) -> str:
+    return " ".join(line.lower())
+
+
+def parse_multipart(content_type: str, body: bytes) -> dict[str, bytes]:
+    message = email.parser.BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in message.get_payload()}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    downloads: dict[str, str] = {}
+    lock = threading.Lock()
+    # requests to runG2P so far, to check how many round trips a client made
+    run_count = 0
+
+    def _send(self, status: int, body: str, content_type: str):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.endswith("/runG2P"):
+            self._send(404, "not found", "text/plain")
+            return
+
+        fields = parse_multipart(self.headers["Content-Type"], self.rfile.read(int(self.headers["Content-Length"])))
+        lng = fields.get("lng", b"").decode()
+
+        with self.lock:
+            StandInHandler.run_count += 1
+
+        if lng not in LANGUAGES:
+            output = f"ERROR: language {lng!r} not supported, possible values: {', '.join(LANGUAGES)}"
+            self._send(200, RESPONSE.format(success="false", download_link="", output=output), "text/xml")
+            return
+
+        text = fields["i"].decode("utf-8")
+        id_ = uuid.uuid4().hex
+        with self.lock:
+            self.downloads[id_] = "\n".join(transcribe(line) for line in text.splitlines()) + "\n"
+
+        host, port = self.server.server_address[:2]
+        download_link = f"http://{host}:{port}/download/{id_}.txt"
+        self._send(200, RESPONSE.format(success="true", download_link=download_link, output=""), "text/xml")
+
+    def do_GET(self):
+        id_ = self.path.rsplit("/", 1)[-1].removesuffix(".txt")
+
+        with self.lock:
+            download = self.downloads.pop(id_, None)
+
+        if download is None:
+            self._send(404, "not found", "text/plain")
+        else:
+            self._send(200, download, "text/plain; charset=utf-8")
+
+
+def serve(port: int = 8000) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    print(f"BAS stand-in listening on http://127.0.0.1:{port}/services/runG2P")
+    ThreadingHTTPServer(("127.0.0.1", port), StandInHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""
+Benchmarks, run from the bot's working directory:
+
+    python benchmark.py g2p [--lng deu]
+    python benchmark.py rhymes [--lng deu] [--copies 1]
+    python benchmark.py trim [--image screenshot.png] [--repeat 3]
+    python benchmark.py cards [--engines pillow browser] [--words 20] [--out card_diffs]
+    python benchmark.py fabric [--fixtures fixtures/postermywall] [--record TEMPLATE_ID ...] [--out fabric_diffs]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+
+def bench_g2p(args: argparse.Namespace):
+    """Accuracy and speed of the local G2P rules against the BAS answers in the G2P cache."""
+    import g2p
+
+    entries = [(word, g2p.process_response(output)) for (word, lng), output in g2p.cache.items() if lng == args.lng]
+    engine = g2p.LOCAL_ENGINES[args.lng]
+
+    if not entries:
+        print(f"No cached BAS transcriptions for {args.lng!r}.")
+        return
+
+    started = time.perf_counter()
+    predictions = [engine(word) for word, _ in entries]
+    duration = time.perf_counter() - started
+
+    handled = exact = without_length = phonemes = phonemes_right = 0
+    mistakes = []
+    for (word, expected), predicted in zip(entries, predictions):
+        if predicted is None:
+            continue
+        handled += 1
+
+        exact += predicted == expected
+        without_length += [p.replace("ː", "") for p in predicted] == [p.replace("ː", "") for p in expected]
+
+        if len(predicted) == len(expected):
+            phonemes += len(expected)
+            phonemes_right += sum(p == e for p, e in zip(predicted, expected))
+
+        if predicted != expected and len(mistakes) < args.show:
+            mistakes.append((word, predicted, expected))
+
+    print(f"{len(entries)} cached words, {handled} ({handled / len(entries):.1%}) handled by the rules")
+    if handled:
+        print(f"{'exact:':<24}{exact / handled:.1%}")
+        print(f"{'ignoring vowel length:':<24}{without_length / handled:.1%}")
+        print(f"{'per phoneme:':<24}{phonemes_right / max(1, phonemes):.1%}")
+    print(f"{'throughput:':<24}{len(entries) / duration:,.0f} words/s ({duration / len(entries) * 1e6:.1f}µs/word)")
+
+    for word, predicted, expected in mistakes:
+        print(f"  {word!r}: {' '.join(predicted)} (BAS: {' '.join(expected)})")
+
+
+def bench_rhymes(args: argparse.Namespace):
+    """Build and query times of the phonetic index over the transcriptions in the G2P cache."""
+    import g2p
+    import phonetic_index
+
+    entries = [(f"{word}#{i}", "".join(g2p.process_response(output)).replace("_", ""))
+               for (word, lng), output in g2p.cache.items() if lng == args.lng
+               for i in range(args.copies)]
+
+    if not entries:
+        print(f"No cached BAS transcriptions for {args.lng!r}.")
+        return
+
+    started = time.perf_counter()
+    index = phonetic_index.PhoneticIndex.build(entries)
+    build_duration = time.perf_counter() - started
+
+    queries = [ipa for _, ipa in entries[:10_000]]
+    started = time.perf_counter()
+    matches = 0
+    for ipa in queries:
+        full, final = index.rhymes(ipa)
+        matches += len(final) + len(index.near_homophones(ipa))
+    query_duration = time.perf_counter() - started
+
+    print(f"{len(index)} entries indexed in {build_duration * 1000:.0f}ms "
+          f"({build_duration / len(entries) * 1e6:.1f}µs/entry)")
+    print(f"{len(queries)} queries in {query_duration * 1000:.0f}ms "
+          f"({query_duration / len(queries) * 1e6:.1f}µs/query, {matches / len(queries):.1f} matches/query)")
+
+
+def _trim_right_loop(image, pad: int):
+    # google_dictionary.get_image before image_tools.trim
+    white = (255, 255, 255, 255)
+    for x in range(image.width - 1, -1, -1):
+        for y in range(0, image.height):
+            if image.getpixel((x, y)) != white:
+                break
+        else:
+            continue
+        break
+    else:
+        raise Exception("Screenshot is blank, maybe you overdid the zoom?")
+
+    return image.crop((0, 0, x + pad, image.height))
+
+
+def _get_sample_card(width: int = 4800, height: int = 1400, content_width: int = 2700):
+    from PIL import Image, ImageDraw
+
+    # white card with dark text-like blocks, like a zoom 3 dictionary screenshot
+    image = Image.new("RGBA", (width, height), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for i, y in enumerate(range(60, height - 100, 110)):
+        draw.rectangle((60, y, 60 + (content_width - 60) * (i % 3 + 1) // 3, y + 50), fill=(32, 33, 36, 255))
+    return image
+
+
+def bench_trim(args: argparse.Namespace):
+    """Time per render of the right edge trim in google_dictionary.get_image: the old getpixel loop vs image_tools."""
+    from PIL import Image
+
+    import image_tools
+
+    image = _get_sample_card() if args.image is None else Image.open(args.image).convert("RGBA")
+    pad = 15
+
+    def timed(func) -> tuple[float, object]:
+        durations = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            out = func()
+            durations.append(time.perf_counter() - started)
+        return min(durations), out
+
+    loop_duration, loop_image = timed(lambda: _trim_right_loop(image, pad))
+    trim_duration, trim_image = timed(lambda: image_tools.trim(image, image_tools.WHITE, sides=("right",), pad=pad))
+
+    print(f"{image.width}x{image.height} screenshot")
+    print(f"{'getpixel loop:':<24}{loop_duration * 1000:,.1f}ms per render, {loop_image.width}px wide")
+    print(f"{'image_tools.trim:':<24}{trim_duration * 1000:,.1f}ms per render, {trim_image.width}px wide")
+    print(f"{'speedup:':<24}{loop_duration / trim_duration:,.0f}x")
+
+
+SAMPLE_WORDS = [("rein·joi·nen", "ˈraɪndʒɔɪnən", "Verb", "einen Internetanruf oder eine Videospielsession betreten",
+                 "Ahh! Er ist wieder reingejoined."),
+                ("lau·fen", "ˈlaʊfn̩", "Verb", "sich in aufrechter Haltung auf den Füßen fortbewegen",
+                 "Wir sind nach Hause gelaufen."),
+                ("Wör·ter·buch", "ˈvœʁtɐˌbuːx", "Substantiv",
+                 "Nachschlagewerk, in dem die Wörter einer Sprache alphabetisch aufgeführt und erklärt werden",
+                 "Das steht so im Wörterbuch.")]
+
+
+def _get_card_words(count: int) -> list:
+    import wörterbuch
+
+    words = []
+    if os.path.exists(f"{wörterbuch.DICT_PREFIX}global.dict"):
+        words = sorted(wörterbuch.Dictionary.from_file("global"), key=lambda word: word.get_data_key())
+    if not words:
+        words = [wörterbuch.Word(wörterbuch.split_word(word), *rest) for word, *rest in SAMPLE_WORDS]
+
+    return (words * (count // len(words) + 1))[:count]
+
+
+async def _render_cards(engine: str, words: list) -> tuple[float, list]:
+    import functools
+
+    import dictionary_card
+    import google_dictionary
+    import seleniumutil
+
+    async def render(word):
+        if engine == "pillow":
+            return await seleniumutil.run_cpu(dictionary_card.render, word)
+        return await seleniumutil.run_function(
+            functools.partial(google_dictionary.capture, word=word.get_display_name(), ipa=word.ipa,
+                              part_of_speech=word.part_of_speech, meaning=word.meaning, example=word.example),
+            size=None, scale=None, postprocess=google_dictionary.postprocess)
+
+    # one warm-up render, e.g. to start a browser
+    await render(words[0])
+
+    started = time.perf_counter()
+    cards = await asyncio.gather(*[render(word) for word in words])
+    return time.perf_counter() - started, cards
+
+
+def bench_cards(args: argparse.Namespace):
+    """Throughput of the dictionary card engines (uncached) and the pixel difference between their cards."""
+    import io
+
+    from PIL import Image
+
+    import image_tools
+
+    words = _get_card_words(args.words)
+    results = {}
+    for engine in args.engines:
+        try:
+            duration, cards = asyncio.run(_render_cards(engine, words))
+        except Exception as e:
+            print(f"{engine}: failed, {e!r}")
+            continue
+
+        results[engine] = cards
+        print(f"{engine + ':':<10}{len(words) / duration:,.1f} cards/s ({duration / len(words) * 1000:,.1f}ms/card)")
+
+    if len(results) < 2:
+        return
+
+    (engine_a, cards_a), (engine_b, cards_b) = list(results.items())[:2]
+    print(f"pixel difference {engine_a} vs {engine_b}:")
+    for i, (word, card_a, card_b) in enumerate(zip(words, cards_a, cards_b)):
+        if i >= len(set(word.get_data_key() for word in words)):
+            break
+
+        image_a, image_b = Image.open(io.BytesIO(card_a)), Image.open(io.BytesIO(card_b))
+        share, mean, difference = image_tools.compare(image_a, image_b, tolerance=args.tolerance)
+        print(f"  {word.get_display_name()!r}: {image_a.size} vs {image_b.size}, {share:.1%} of the pixels differ, "
+              f"mean difference {mean:.1f}")
+
+        if args.out is not None:
+            os.makedirs(args.out, exist_ok=True)
+            image_a.save(os.path.join(args.out, f"{i}_{engine_a}.png"))
+            image_b.save(os.path.join(args.out, f"{i}_{engine_b}.png"))
+            difference.save(os.path.join(args.out, f"{i}_difference.png"))
+
+
+def _get_asset_path(fixtures: str, url: str) -> str:
+    import hashlib
+
+    return os.path.join(fixtures, "assets", hashlib.sha1(url.encode()).hexdigest())
+
+
+async def _record_fixtures(fixtures: str, template_ids: list[str]):
+    import json
+
+    import fabric_render
+    import postermywall
+
+    os.makedirs(os.path.join(fixtures, "assets"), exist_ok=True)
+    for template_id in template_ids:
+        template = await postermywall.Template.from_id(template_id)
+        data = await template.get_canvas_data()
+        image = (await template.get_variants([[]], engine="browser"))[0]
+
+        for url in fabric_render.get_image_sources(data):
+            with open(_get_asset_path(fixtures, url), "wb") as f:
+                f.write(await postermywall.get_asset(url))
+
+        with open(os.path.join(fixtures, f"{template_id}.json"), "w") as f:
+            json.dump(data, f)
+        with open(os.path.join(fixtures, f"{template_id}.png"), "wb") as f:
+            f.write(image)
+        print(f"recorded {template_id}")
+
+
+def bench_fabric(args: argparse.Namespace):
+    """
+    Pixel difference and speed of fabric_render against browser renders of the same canvas JSON. A fixture is
+    <name>.json (the canvas) and <name>.png (the browser's render at multiplier 1), with the images in assets/ and
+    additional fonts in fonts/. --record adds fixtures of PosterMyWall templates, that needs a browser.
+    """
+    import io
+    import json
+
+    from PIL import Image
+
+    import fabric_render
+    import image_tools
+
+    if args.record:
+        asyncio.run(_record_fixtures(args.fixtures, args.record))
+
+    font_dirs = [os.path.join(args.fixtures, "fonts"), fabric_render.FONT_DIR]
+    names = []
+    if os.path.isdir(args.fixtures):
+        names = sorted(os.path.splitext(name)[0] for name in os.listdir(args.fixtures) if name.endswith(".json"))
+    if not names:
+        print(f"No fixtures in {args.fixtures!r}, add some with --record")
+        return
+
+    for name in names:
+        with open(os.path.join(args.fixtures, f"{name}.json")) as f:
+            data = json.load(f)
+
+        images = {}
+        for url in fabric_render.get_image_sources(data):
+            if os.path.exists(path := _get_asset_path(args.fixtures, url)):
+                with open(path, "rb") as f:
+                    images[url] = f.read()
+
+        try:
+            started = time.perf_counter()
+            rendered = fabric_render.render(data, images, font_dirs=font_dirs)
+            duration = time.perf_counter() - started
+        except fabric_render.UnsupportedObject as e:
+            print(f"{name}: unsupported, {e}")
+            continue
+
+        image = Image.open(io.BytesIO(rendered))
+        reference = Image.open(os.path.join(args.fixtures, f"{name}.png"))
+        share, mean, difference = image_tools.compare(image, reference, tolerance=args.tolerance)
+        print(f"{name}: {duration * 1000:,.1f}ms, {image.size} vs {reference.size}, {share:.1%} of the pixels differ, "
+              f"mean difference {mean:.1f}")
+
+        if args.out is not None:
+            os.makedirs(args.out, exist_ok=True)
+            image.save(os.path.join(args.out, f"{name}_pillow.png"))
+            difference.save(os.path.join(args.out, f"{name}_difference.png"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(required=True)
+
+    g2p_parser = subparsers.add_parser("g2p", help=bench_g2p.__doc__)
+    g2p_parser.add_argument("--lng", default="deu")
+    g2p_parser.add_argument("--show", type=int, default=20, help="number of mismatches to print")
+    g2p_parser.set_defaults(func=bench_g2p)
+
+    rhymes_parser = subparsers.add_parser("rhymes", help=bench_rhymes.__doc__)
+    rhymes_parser.add_argument("--lng", default="deu")
+    rhymes_parser.add_argument("--copies", type=int, default=1,
+                               help="index every transcription this many times to simulate a larger dictionary")
+    rhymes_parser.set_defaults(func=bench_rhymes)
+
+    trim_parser = subparsers.add_parser("trim", help=bench_trim.__doc__)
+    trim_parser.add_argument("--image", help="a page screenshot, a generated card by default")
+    trim_parser.add_argument("--repeat", type=int, default=3)
+    trim_parser.set_defaults(func=bench_trim)
+
+    cards_parser = subparsers.add_parser("cards", help=bench_cards.__doc__)
+    cards_parser.add_argument("--engines", nargs="+", default=["pillow", "browser"], choices=["pillow", "browser"])
+    cards_parser.add_argument("--words", type=int, default=20, help="cards rendered per engine")
+    cards_parser.add_argument("--tolerance", type=int, default=16, help="per channel difference that still counts "
+                                                                        "as the same pixel")
+    cards_parser.add_argument("--out", help="directory for the cards of both engines and their difference images")
+    cards_parser.set_defaults(func=bench_cards)
+
+    fabric_parser = subparsers.add_parser("fabric", help=bench_fabric.__doc__)
+    fabric_parser.add_argument("--fixtures", default="fixtures/postermywall", help="directory of the fixtures")
+    fabric_parser.add_argument("--record", nargs="+", metavar="TEMPLATE_ID", help="templates to add as fixtures first")
+    fabric_parser.add_argument("--tolerance", type=int, default=16, help="per channel difference that still counts "
+                                                                         "as the same pixel")
+    fabric_parser.add_argument("--out", help="directory for the renders and their difference images")
+    fabric_parser.set_defaults(func=bench_fabric)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
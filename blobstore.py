@@ -0,0 +1,328 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Union
+
+from context_logger import log
+
+# index file layout:
+#   header: magic, version, record count (padded to RECORD.size)
+#   records: key, segment, offset, length, written, accessed
+HEADER = struct.Struct("<4sIQ")
+RECORD = struct.Struct("<32sIQIdd")
+MAGIC = b"BLOB"
+VERSION = 1
+
+# length of a record whose entry was deleted or superseded
+DELETED = 0xFFFFFFFF
+
+# offsets of the mutable record fields, for in-place updates through the index map
+_LENGTH_OFFSET = 32 + 4 + 8
+_ACCESSED_OFFSET = 32 + 4 + 8 + 4 + 8
+
+SEGMENT_SIZE = 64 * 1024 ** 2
+INITIAL_INDEX_CAPACITY = 1024
+
+
+class BlobStore:
+    """
+    Append-only key -> bytes store. Values live back to back in segment files, an index of fixed-size records
+    maps every key to (segment, offset, length). Both are read through memory maps, so a hit is a memoryview into
+    the page cache.
+    """
+
+    def __init__(self, path: str, segment_size: int = SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+
+        self.index_path = os.path.join(path, "index.dat")
+
+        self._lock = threading.RLock()
+        # key -> slot of its record in the index
+        self._slots: dict[bytes, int] = {}
+        self._count = 0
+        self._capacity = 0
+        self._index_file = None
+        self._index_map: Union[mmap.mmap, None] = None
+
+        # segment -> [total bytes, dead bytes]
+        self._segments: dict[int, list[int]] = {}
+        self._segment_maps: dict[int, mmap.mmap] = {}
+        self._active_segment = 0
+        self._active_file = None
+
+        self.size = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._open_index()
+        self._open_active_segment()
+
+    # index
+
+    def _open_index(self):
+        if not os.path.exists(self.index_path):
+            self._write_empty_index(self.index_path, INITIAL_INDEX_CAPACITY)
+
+        self._index_file = open(self.index_path, "r+b")
+        self._map_index()
+
+        magic, version, self._count = HEADER.unpack_from(self._index_map, 0)
+        assert magic == MAGIC and version == VERSION, f"{self.index_path!r} is not a blob store index."
+
+        segment_file_sizes = {}
+        for slot in range(self._count):
+            key, segment, offset, length, _, _ = self._read_record(slot)
+
+            self._segments.setdefault(segment, [0, 0])
+            if length == DELETED:
+                continue
+
+            if segment not in segment_file_sizes:
+                segment_file_sizes[segment] = self._segment_file_size(segment)
+            if offset + length > segment_file_sizes[segment]:
+                # values are flushed before they are indexed, but a power loss can still persist the index without
+                # the end of a segment, such records are unreadable
+                log(f"Dropping the record of {key.hex()}, it points past the end of segment {segment} 🗑")
+                struct.pack_into("<I", self._index_map, self._record_offset(slot) + _LENGTH_OFFSET, DELETED)
+                continue
+
+            self._slots[key] = slot
+            self.size += length
+            self._segments[segment][0] += length
+
+        for segment in self._existing_segments():
+            self._segments.setdefault(segment, [0, 0])
+            self._segments[segment][1] = self._segment_file_size(segment) - self._segments[segment][0]
+
+    @staticmethod
+    def _write_empty_index(path: str, capacity: int):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0).ljust(RECORD.size, b"\0"))
+            f.truncate(RECORD.size * (capacity + 1))
+
+    def _map_index(self):
+        self._index_map = mmap.mmap(self._index_file.fileno(), 0)
+        self._capacity = len(self._index_map) // RECORD.size - 1
+
+    def _record_offset(self, slot: int):
+        return RECORD.size * (slot + 1)
+
+    def _read_record(self, slot: int):
+        return RECORD.unpack_from(self._index_map, self._record_offset(slot))
+
+    def _append_record(self, key: bytes, segment: int, offset: int, length: int, written: float, accessed: float):
+        if self._count == self._capacity:
+            self._index_map.close()
+            self._index_file.truncate(RECORD.size * (self._capacity * 2 + 1))
+            self._map_index()
+
+        slot = self._count
+        RECORD.pack_into(self._index_map, self._record_offset(slot), key, segment, offset, length, written, accessed)
+
+        # bump the count only after the record is complete, a crash in between just loses the record
+        self._count += 1
+        HEADER.pack_into(self._index_map, 0, MAGIC, VERSION, self._count)
+
+        return slot
+
+    def _kill_slot(self, slot: int):
+        _, segment, _, length, _, _ = self._read_record(slot)
+        struct.pack_into("<I", self._index_map, self._record_offset(slot) + _LENGTH_OFFSET, DELETED)
+
+        self.size -= length
+        self._segments[segment][0] -= length
+        self._segments[segment][1] += length
+
+    # segments
+
+    def _segment_path(self, segment: int):
+        return os.path.join(self.path, f"segment-{segment:06}.dat")
+
+    def _segment_file_size(self, segment: int):
+        try:
+            return os.path.getsize(self._segment_path(segment))
+        except FileNotFoundError:
+            return 0
+
+    def _existing_segments(self) -> list[int]:
+        out = []
+        for name in os.listdir(self.path):
+            if name.startswith("segment-") and name.endswith(".dat"):
+                out.append(int(name[len("segment-"):-len(".dat")]))
+        return sorted(out)
+
+    def _open_active_segment(self):
+        self._active_segment = max(self._existing_segments(), default=0)
+        self._active_file = open(self._segment_path(self._active_segment), "ab")
+        self._segments.setdefault(self._active_segment, [0, 0])
+
+    def _roll_segment(self):
+        self._active_file.close()
+        self._active_segment += 1
+        self._active_file = open(self._segment_path(self._active_segment), "ab")
+        self._segments[self._active_segment] = [0, 0]
+
+    def _segment_map(self, segment: int, end: int) -> mmap.mmap:
+        map_ = self._segment_maps.get(segment)
+        if map_ is None or len(map_) < end:
+            # the active segment grew since it was mapped; the old map stays valid for views that still use it
+            with open(self._segment_path(segment), "rb") as f:
+                map_ = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._segment_maps[segment] = map_
+        return map_
+
+    # public
+
+    def __contains__(self, key: bytes):
+        return key in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def dead_size(self):
+        return sum(dead for _, dead in self._segments.values())
+
+    def get(self, key: bytes) -> Union[memoryview, None]:
+        if (entry := self.get_entry(key)) is None:
+            return None
+        return entry[0]
+
+    def get_entry(self, key: bytes) -> Union[tuple[memoryview, float], None]:
+        """(value, written)"""
+        with self._lock:
+            if (slot := self._slots.get(key)) is None:
+                return None
+
+            _, segment, offset, length, written, _ = self._read_record(slot)
+            struct.pack_into("<d", self._index_map, self._record_offset(slot) + _ACCESSED_OFFSET, time.time())
+
+            if length == 0:
+                return memoryview(b""), written
+
+            map_ = self._segment_map(segment, offset + length)
+
+        return memoryview(map_)[offset:offset + length], written
+
+    def put(self, key: bytes, data: bytes, written: float = None, accessed: float = None):
+        with self._lock:
+            self._put_many([(key, data, written, accessed)])
+
+    def put_many(self, items: list[tuple[bytes, bytes, float]]):
+        """items: (key, value, written)"""
+        with self._lock:
+            self._put_many([(key, data, written, None) for key, data, written in items])
+
+    def _write(self, data: bytes) -> tuple[int, int]:
+        """Appends data to the active segment, (segment, offset)."""
+        if self._active_file.tell() + len(data) > self.segment_size and self._active_file.tell():
+            self._roll_segment()
+
+        offset = self._active_file.tell()
+        self._active_file.write(data)
+        return self._active_segment, offset
+
+    def _put_many(self, items: list[tuple[bytes, bytes, Union[float, None], Union[float, None]]]):
+        """items: (key, value, written, accessed)"""
+        locations = [self._write(data) for _, data, _, _ in items]
+
+        # the values have to be in the segment files before any record points to them, a crash in between only
+        # leaves dead bytes
+        self._active_file.flush()
+
+        for (key, data, written, accessed), (segment, offset) in zip(items, locations):
+            written = time.time() if written is None else written
+            accessed = written if accessed is None else accessed
+
+            if (old := self._slots.get(key)) is not None:
+                self._kill_slot(old)
+
+            self._slots[key] = self._append_record(key, segment, offset, len(data), written, accessed)
+            self.size += len(data)
+            self._segments[segment][0] += len(data)
+
+    def delete(self, key: bytes):
+        with self._lock:
+            if (slot := self._slots.pop(key, None)) is not None:
+                self._kill_slot(slot)
+
+    def entries(self) -> Iterator[tuple[bytes, int, float, float]]:
+        """(key, length, written, accessed) of every live entry"""
+        with self._lock:
+            records = [self._read_record(slot) for slot in self._slots.values()]
+
+        for key, _, _, length, written, accessed in records:
+            yield key, length, written, accessed
+
+    def compact(self, min_dead_ratio: float = .5):
+        with self._lock, log(f"Compacting blob store {self.path!r} 🗜"):
+            # move the live entries out of sealed segments that are mostly dead, then drop those segments
+            for segment, (live, dead) in list(self._segments.items()):
+                if segment == self._active_segment or dead == 0 or dead / (live + dead) < min_dead_ratio:
+                    continue
+
+                log(f"segment {segment}: {live:_} live, {dead:_} dead bytes")
+                items = []
+                for key, slot in list(self._slots.items()):
+                    _, record_segment, offset, length, written, accessed = self._read_record(slot)
+                    if record_segment != segment:
+                        continue
+
+                    data = bytes(self._segment_map(segment, offset + length)[offset:offset + length])
+                    items.append((key, data, written, accessed))
+
+                self._put_many(items)
+
+                # views handed out earlier keep the old map alive, so it is dropped instead of closed
+                self._segment_maps.pop(segment, None)
+                del self._segments[segment]
+                os.remove(self._segment_path(segment))
+
+            if self._count - len(self._slots) > len(self._slots):
+                self._rewrite_index()
+
+    def _rewrite_index(self):
+        records = sorted((self._read_record(slot) for slot in self._slots.values()), key=lambda r: (r[1], r[2]))
+
+        tmp_path = f"{self.index_path}.tmp"
+        self._write_empty_index(tmp_path, max(INITIAL_INDEX_CAPACITY, len(records) * 2))
+        with open(tmp_path, "r+b") as f:
+            f.seek(RECORD.size)
+            for record in records:
+                f.write(RECORD.pack(*record))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+
+        self._index_map.close()
+        self._index_file.close()
+        os.replace(tmp_path, self.index_path)
+
+        self._index_file = open(self.index_path, "r+b")
+        self._map_index()
+        self._count = len(records)
+        self._slots = {record[0]: slot for slot, record in enumerate(records)}
+
+    def flush(self):
+        with self._lock:
+            self._active_file.flush()
+            self._index_map.flush()
+
+
+def migrate_directory(store: BlobStore, path: str):
+    """Moves a one-file-per-hash cache folder (the old cachelib layout) into the store."""
+
+    loose_files = [entry for entry in os.scandir(path) if entry.is_file() and len(entry.name) == 64]
+
+    if not loose_files:
+        return
+
+    with log(f"Migrating {len(loose_files)} cache files into the blob store 📦"):
+        for entry in loose_files:
+            stat = entry.stat()
+            with open(entry.path, "rb") as f:
+                store.put(bytes.fromhex(entry.name), f.read(), stat.st_mtime, max(stat.st_atime, stat.st_mtime))
+            os.remove(entry.path)
+
+        store.flush()
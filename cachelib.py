@@ -1,29 +1,407 @@
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import contextvars
+import dataclasses
 import hashlib
-import msgpack
+import heapq
 import os
+import threading
+import time
+from typing import Awaitable, Callable, TypeVar, Union
+
+import msgpack
 
+import blobstore
 from context_logger import log, log_decorator
 
+T = TypeVar("T")
+
 PATH = "cache"
 
+MEMORY_BUDGET = 64 * 1024 ** 2  # bytes
+DISK_BUDGET = 2 * 1024 ** 3  # bytes
+
+# when the disk tier is over budget, evict down to this fraction of it so that not every save evicts
+DISK_LOW_WATERMARK = .9
+# threads doing disk I/O for aget/asave
+IO_WORKERS = 4
+
+# compact the disk tier once evicted entries take up this fraction of the live data
+COMPACTION_RATIO = .5
+# lookups per namespace the latency percentiles are computed over
+LATENCY_SAMPLES = 1000
+
 
 def get_hash(obj):
     data = obj if isinstance(obj, bytes) else msgpack.dumps(obj)
     return hashlib.sha256(data).hexdigest()
 
 
-def get_path(hash_: str):
-    return os.path.join(PATH, hash_)
+@dataclasses.dataclass
+class Namespace:
+    """
+    Hash objects that are tuples starting with a registered namespace name belong to that namespace, e.g.
+    ("modify", id_, modifications). If the namespace is scoped, the second element (e.g. the template id) can be
+    invalidated on its own.
+    """
+    name: str
+    # seconds an entry is fresh, None: forever
+    ttl: Union[float, None] = None
+    # seconds after the ttl in which the entry is still served while cached() refreshes it in the background
+    stale_ttl: float = 0
+    scoped: bool = False
+
+
+namespaces: dict[str, Namespace] = {}
+
+
+def register_namespace(name: str, ttl: float = None, stale_ttl: float = 0, scoped: bool = False) -> Namespace:
+    namespaces[name] = Namespace(name, ttl, stale_ttl, scoped)
+    return namespaces[name]
+
+
+def get_namespace(obj) -> tuple[Union[Namespace, None], object]:
+    """(namespace, scope) of a hash object"""
+    if isinstance(obj, (tuple, list)) and obj and isinstance(obj[0], str) and obj[0] in namespaces:
+        namespace = namespaces[obj[0]]
+        return namespace, obj[1] if namespace.scoped and len(obj) > 1 else None
+    return None, None
+
+
+class Generations:
+    """Invalidation counters. Bumping one changes the keys of everything it covers, old entries just age out."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self._generations = msgpack.loads(f.read())
+
+    @staticmethod
+    def _name(namespace: str, scope=None):
+        return namespace if scope is None else f"{namespace}/{get_hash(scope)}"
+
+    def get(self, namespace: str, scope=None) -> int:
+        return self._generations.get(self._name(namespace, scope), 0)
+
+    def bump(self, namespace: str, scope=None):
+        with self._lock:
+            name = self._name(namespace, scope)
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(msgpack.dumps(self._generations))
+            os.replace(tmp_path, self.path)
+
+
+class Stats:
+    def __init__(self):
+        self.counters = collections.Counter()
+        # seconds, only the most recent lookups
+        self.latencies: collections.deque[float] = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def percentile(self, percent: float) -> Union[float, None]:
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def to_dict(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        p50, p95 = self.percentile(50), self.percentile(95)
+
+        return {"hits": self.counters["hits"],
+                "stale_hits": self.counters["stale_hits"],
+                "misses": self.counters["misses"],
+                "hit_rate": self.counters["hits"] / lookups if lookups else None,
+                "bytes_read": self.counters["bytes_read"],
+                "writes": self.counters["writes"],
+                "bytes_written": self.counters["bytes_written"],
+                "p50_ms": None if p50 is None else p50 * 1000,
+                "p95_ms": None if p95 is None else p95 * 1000}
+
+
+# namespace name (or "other") -> lookup and write statistics
+stats: dict[str, Stats] = collections.defaultdict(Stats)
+# hits per tier, over all namespaces
+tier_stats = collections.Counter()
+_stats_lock = threading.Lock()
+
+
+def _stats_name(obj) -> str:
+    namespace, _ = get_namespace(obj)
+    return "other" if namespace is None else namespace.name
+
+
+def _record_lookup(obj, entry: Union[tuple[Union[bytes, memoryview], bool], None], started: float):
+    with _stats_lock:
+        namespace_stats = stats[_stats_name(obj)]
+        namespace_stats.latencies.append(time.perf_counter() - started)
+
+        if entry is None:
+            namespace_stats.counters["misses"] += 1
+        else:
+            data, is_stale = entry
+            namespace_stats.counters["hits"] += 1
+            namespace_stats.counters["stale_hits"] += is_stale
+            namespace_stats.counters["bytes_read"] += len(data)
+
+
+def _record_write(obj, content: bytes):
+    with _stats_lock:
+        namespace_stats = stats[_stats_name(obj)]
+        namespace_stats.counters["writes"] += 1
+        namespace_stats.counters["bytes_written"] += len(content)
+
+
+def get_stats() -> dict:
+    """Everything as plain JSON-serializable data."""
+    with _stats_lock:
+        out = {"namespaces": {name: namespace_stats.to_dict() for name, namespace_stats in stats.items()}}
+
+    if _cache is not None:
+        out["tiers"] = {
+            "memory": {"hits": tier_stats["memory_hits"], "evictions": _cache.memory.evictions,
+                       "size": _cache.memory.size, "budget": _cache.memory.budget},
+            "disk": {"hits": tier_stats["disk_hits"], "evictions": _cache.disk.evictions,
+                     "size": _cache.disk.size, "budget": _cache.disk.budget, "entries": len(_cache.disk.store),
+                     "dead_size": _cache.disk.store.dead_size}
+        }
+
+    return out
+
+
+class MemoryTier:
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.evictions = 0
+
+        # hash -> (value, written); values are bytes or memoryviews into the disk tier's segment maps
+        self._entries: collections.OrderedDict[str, tuple[Union[bytes, memoryview], float]] = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, hash_: str) -> Union[tuple[Union[bytes, memoryview], float], None]:
+        with self._lock:
+            entry = self._entries.get(hash_)
+            if entry is not None:
+                self._entries.move_to_end(hash_)
+            return entry
+
+    def put(self, hash_: str, data: bytes, written: float):
+        with self._lock:
+            self._discard(hash_)
+
+            # an entry bigger than the whole budget would just flush everything else out
+            if len(data) > self.budget:
+                return
+
+            self._entries[hash_] = data, written
+            self.size += len(data)
+
+            while self.size > self.budget:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def discard(self, hash_: str):
+        with self._lock:
+            self._discard(hash_)
+
+    def _discard(self, hash_: str):
+        if (entry := self._entries.pop(hash_, None)) is not None:
+            self.size -= len(entry[0])
+
+
+class DiskTier:
+    def __init__(self, path: str, budget: int):
+        self.path = path
+        self.budget = budget
+
+        self.store = blobstore.BlobStore(path)
+
+        # one file per hash plus an access time index was the layout before the blob store
+        blobstore.migrate_directory(self.store, path)
+        if os.path.exists(legacy_index := os.path.join(path, "index.msgpack")):
+            os.remove(legacy_index)
+
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.store.size
+
+    def get(self, hash_: str) -> Union[tuple[memoryview, float], None]:
+        return self.store.get_entry(bytes.fromhex(hash_))
+
+    def put(self, hash_: str, data: bytes, written: float):
+        self.put_many([(hash_, data, written)])
+
+    def put_many(self, items: list[tuple[str, bytes, float]]):
+        self.store.put_many([(bytes.fromhex(hash_), data, written) for hash_, data, written in items])
+
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        if self.store.size <= self.budget:
+            return
+
+        target = self.budget * DISK_LOW_WATERMARK
+        with log(f"Disk cache over budget ({self.store.size:_}/{self.budget:_} bytes), evicting 🧹"):
+            by_access = [(accessed, key) for key, _, _, accessed in self.store.entries()]
+            heapq.heapify(by_access)
+
+            while self.store.size > target and by_access:
+                _, key = heapq.heappop(by_access)
+                self.store.delete(key)
+                self.evictions += 1
+
+        if self.store.dead_size > self.store.size * COMPACTION_RATIO:
+            self.store.compact()
+
+    def flush(self):
+        self.store.flush()
+
+
+class Cache:
+    def __init__(self, path: str = PATH, memory_budget: int = MEMORY_BUDGET, disk_budget: int = DISK_BUDGET):
+        self.memory = MemoryTier(memory_budget)
+        self.disk = DiskTier(path, disk_budget)
+        self.generations = Generations(os.path.join(path, "generations.msgpack"))
+
+        # writes queued by save_batched, all of them go to disk in one go
+        self._pending: dict[str, tuple[bytes, float]] = {}
+        self._pending_flush: Union[concurrent.futures.Future, None] = None
+        self._pending_lock = threading.Lock()
+
+    def get_key(self, obj) -> str:
+        namespace, scope = get_namespace(obj)
+        if namespace is None:
+            return get_hash(obj)
+
+        generations = (self.generations.get(namespace.name), self.generations.get(namespace.name, scope))
+        if generations == (0, 0):
+            # keys from before the namespace was ever invalidated stay valid
+            return get_hash(obj)
+
+        return get_hash([*generations, obj])
+
+    def get(self, hash_: str) -> Union[tuple[Union[bytes, memoryview], float], None]:
+        """(value, written)"""
+        if (entry := self.memory.get(hash_)) is not None:
+            log("found in memory! ⚡")
+            tier_stats["memory_hits"] += 1
+            return entry
+
+        with self._pending_lock:
+            if (entry := self._pending.get(hash_)) is not None:
+                log("found in the write queue! ⏳")
+                tier_stats["memory_hits"] += 1
+                return entry
+
+        if (entry := self.disk.get(hash_)) is not None:
+            log("found on disk! ✅")
+            tier_stats["disk_hits"] += 1
+            self.memory.put(hash_, *entry)
+            return entry
+
+        return None
+
+    def save(self, hash_: str, content: bytes):
+        written = time.time()
+        self.memory.put(hash_, content, written)
+        self.disk.put(hash_, content, written)
+
+    def save_batched(self, hash_: str, content: bytes) -> concurrent.futures.Future:
+        """Queues the write, the returned future resolves once it (and everything queued with it) is on disk."""
+        written = time.time()
+        self.memory.put(hash_, content, written)
+
+        with self._pending_lock:
+            self._pending[hash_] = content, written
+
+            if self._pending_flush is None:
+                self._pending_flush = _io_pool.submit(self._flush_pending)
+
+            return self._pending_flush
+
+    def _flush_pending(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+            self._pending_flush = None
+
+        self.disk.put_many([(hash_, content, written) for hash_, (content, written) in batch.items()])
+
+
+_cache: Union[Cache, None] = None
+_cache_lock = threading.Lock()
+
+_io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="cachelib")
+
+# hash -> result of the job currently producing it; concurrent futures so that callers on any event loop can wait
+_in_flight: dict[str, concurrent.futures.Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_cache() -> Cache:
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = Cache(PATH, MEMORY_BUDGET, DISK_BUDGET)
+            atexit.register(_cache.disk.flush)
+
+    return _cache
+
+
+def _check_age(obj, entry: Union[tuple[Union[bytes, memoryview], float], None]):
+    """(value, is_stale) of a cache entry, None if there is none or it expired"""
+    if entry is None:
+        return None
+
+    data, written = entry
+    namespace, _ = get_namespace(obj)
+    if namespace is None or namespace.ttl is None:
+        return data, False
+
+    age = time.time() - written
+    if age <= namespace.ttl:
+        return data, False
+    if age <= namespace.ttl + namespace.stale_ttl:
+        log(f"stale ({age:.0f}s old) 🥀")
+        return data, True
+
+    log(f"expired ({age:.0f}s old) 🪦")
+    return None
+
+
+def _lookup(obj) -> Union[tuple[Union[bytes, memoryview], bool], None]:
+    cache = get_cache()
+    return _check_age(obj, cache.get(cache.get_key(obj)))
+
+
+def lookup(obj) -> Union[tuple[Union[bytes, memoryview], bool], None]:
+    """(value, is_stale)"""
+    started = time.perf_counter()
+    entry = _lookup(obj)
+    _record_lookup(obj, entry, started)
+    return entry
 
 
 @log_decorator("Looking in the cache 👀")
 def get(obj):
-    path = get_path(get_hash(obj))
-
-    if os.path.exists(path):
-        with open(path, "rb") as f:
-            log("found! ✅")
-            return f.read()
+    if (entry := lookup(obj)) is not None:
+        return entry[0]
 
     log("not found 😐")
     return None
@@ -31,7 +409,146 @@ def get(obj):
 
 @log_decorator("Saving to cache 💾")
 def save(content: bytes, hash_obj):
-    path = get_path(get_hash(hash_obj))
+    cache = get_cache()
+    cache.save(cache.get_key(hash_obj), content)
+    _record_write(hash_obj, content)
+
+
+def _run_io(func: Callable, *args):
+    # the copied context carries the logger over into the worker thread
+    return asyncio.wrap_future(_io_pool.submit(contextvars.copy_context().run, func, *args))
+
+
+async def alookup(obj) -> Union[tuple[Union[bytes, memoryview], bool], None]:
+    """(value, is_stale)"""
+    started = time.perf_counter()
+
+    # memory hits don't need a thread
+    if _cache is not None and (entry := _cache.memory.get(_cache.get_key(obj))) is not None:
+        log("found in memory! ⚡")
+        tier_stats["memory_hits"] += 1
+        entry = _check_age(obj, entry)
+    else:
+        entry = await _run_io(_lookup, obj)
+
+    _record_lookup(obj, entry, started)
+    return entry
+
+
+@log_decorator("Looking in the cache 👀")
+async def aget(obj):
+    if (entry := await alookup(obj)) is not None:
+        return entry[0]
+
+    log("not found 😐")
+    return None
+
+
+@log_decorator("Saving to cache 💾")
+async def asave(content: bytes, hash_obj):
+    cache = _cache if _cache is not None else await _run_io(get_cache)
+
+    _record_write(hash_obj, content)
+    await asyncio.wrap_future(cache.save_batched(cache.get_key(hash_obj), content))
+
+
+@log_decorator(lambda args: f"Invalidating cache namespace {args['namespace']!r} 🗑")
+def invalidate(namespace: str, scope=None):
+    """Drops every entry of the namespace, or of one scope of it (e.g. one template id), in O(1)."""
+    get_cache().generations.bump(namespace, scope)
+
+
+def get_generation(namespace: str, scope=None) -> int:
+    """Changes with every invalidate of the namespace or the scope, for state kept outside the cache."""
+    generations = get_cache().generations
+    return generations.get(namespace) + (0 if scope is None else generations.get(namespace, scope))
+
+
+class _LeaderCancelled(Exception):
+    ...
+
+
+async def single_flight(hash_obj, func: Callable[[], Awaitable[T]]) -> T:
+    """Runs func only once for concurrent callers with the same hash_obj, the others await its result."""
+    hash_ = get_hash(hash_obj)
+
+    while 1:
+        with _in_flight_lock:
+            future = _in_flight.get(hash_)
+            is_leader = future is None
+            if is_leader:
+                future = _in_flight[hash_] = concurrent.futures.Future()
+
+        if is_leader:
+            break
+
+        with log("Identical job already running, waiting for its result 🤝"):
+            try:
+                # shielded, a cancelled follower must not cancel the leader's result for everyone else
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                log("leader was cancelled, taking over 🏃")
+
+    try:
+        result = await func()
+    except asyncio.CancelledError:
+        _finish_flight(hash_, future, exception=_LeaderCancelled())
+        raise
+    except BaseException as e:
+        _finish_flight(hash_, future, exception=e)
+        raise
+
+    _finish_flight(hash_, future, result=result)
+    return result
+
+
+def _finish_flight(hash_: str, future: concurrent.futures.Future, result=None, exception: BaseException = None):
+    with _in_flight_lock:
+        del _in_flight[hash_]
+
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+# background refreshes started by cached(), referenced so they don't get garbage collected mid-flight
+_refreshes: set[asyncio.Task] = set()
+# True inside those, e.g. to give their work a lower priority
+refreshing: contextvars.ContextVar[bool] = contextvars.ContextVar("refreshing", default=False)
+
+
+def _refresh_done(task: asyncio.Task):
+    _refreshes.discard(task)
+
+    if not task.cancelled() and (exception := task.exception()) is not None:
+        log(f"Background refresh failed, keeping the stale value 😢 {exception!r}")
+
+
+async def _refresh(hash_obj, func: Callable[[], Awaitable[bytes]]) -> bytes:
+    refreshing.set(True)
+    return await single_flight(hash_obj, func)
+
+
+async def cached(hash_obj, func: Callable[[], Awaitable[bytes]]) -> bytes:
+    """
+    Returns the cached value for hash_obj, otherwise produces it with func (once for all concurrent callers) and
+    saves it. Stale values are returned right away and refreshed in the background.
+    """
+    async def produce():
+        out = await func()
+        await asave(out, hash_obj)
+        return out
+
+    if (entry := await alookup(hash_obj)) is not None:
+        data, is_stale = entry
+
+        if is_stale:
+            log("refreshing in the background 🔄")
+            task = asyncio.create_task(_refresh(hash_obj, produce))
+            _refreshes.add(task)
+            task.add_done_callback(_refresh_done)
+
+        return data
 
-    with open(path, "wb") as f:
-        f.write(content)
+    return await single_flight(hash_obj, produce)
@@ -0,0 +1,120 @@
+"""
+Draws dictionary cards with Pillow, laid out like Google's dictionary card that google_dictionary screenshots, without
+needing a browser.
+"""
+import dataclasses
+import functools
+import io
+from typing import TYPE_CHECKING, Union
+
+from PIL import Image, ImageDraw, ImageFont
+
+import image_tools
+from context_logger import log
+
+if TYPE_CHECKING:
+    from wörterbuch import Word
+
+# searched in this order, the first existing file of a style is used; fonts/dictionary is for Google's own fonts
+FONT_CANDIDATES = {
+    "regular": ["fonts/dictionary/Roboto-Regular.ttf", "fonts/dictionary/Arial.ttf",
+                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "DejaVuSans.ttf"],
+    "italic": ["fonts/dictionary/Roboto-Italic.ttf", "fonts/dictionary/Arial-Italic.ttf",
+               "/usr/share/fonts/truetype/dejavu/DejaVuSans-Oblique.ttf", "DejaVuSans-Oblique.ttf"],
+}
+
+# css pixels, multiplied by the zoom
+WIDTH = 652
+PADDING = 16
+NUMBER_WIDTH = 24
+LINE_SPACING = 1.35
+
+
+@dataclasses.dataclass(frozen=True)
+class Style:
+    size: int
+    color: str
+    font: str = "regular"
+    # space above, in css pixels
+    margin: int = 0
+
+
+STYLES = {
+    "word": Style(28, "#202124"),
+    "ipa": Style(16, "#70757a", margin=2),
+    "part_of_speech": Style(14, "#202124", "italic", margin=14),
+    "meaning": Style(16, "#202124", margin=10),
+    "example": Style(16, "#70757a", margin=4),
+}
+
+
+def get_hash_obj(word: str, ipa: str, part_of_speech: str, meaning: str, example: str, zoom=3):
+    return "dictionary", "pillow", word, ipa, part_of_speech, meaning, example, zoom
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(style: str, size: int) -> Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]:
+    for path in FONT_CANDIDATES[style]:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+
+    if style != "regular":
+        return get_font("regular", size)
+    return ImageFont.load_default(size)
+
+
+def wrap(text: str, font: ImageFont.FreeTypeFont, max_width: float) -> list[str]:
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            if line and font.getlength(f"{line} {word}") > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    return lines
+
+
+def render_card(word: str, ipa: str, part_of_speech: str, meaning: str, example: str, zoom=3) -> bytes:
+    """PNG of the card, same arguments and about the same look as google_dictionary.get_image."""
+    texts = {"word": word, "ipa": ipa, "part_of_speech": part_of_speech, "meaning": meaning, "example": f'"{example}"'}
+
+    # (x, y, line, font, color) in image pixels
+    lines: list[tuple[float, float, str, ImageFont.FreeTypeFont, str]] = []
+    y = PADDING * zoom
+    for field, text in texts.items():
+        style = STYLES[field]
+        font = get_font(style.font, style.size * zoom)
+        y += style.margin * zoom
+
+        x = PADDING * zoom
+        if field in ("meaning", "example"):
+            # numbered like the first meaning of Google's card
+            if field == "meaning":
+                lines.append((x, y, "1.", font, style.color))
+            x += NUMBER_WIDTH * zoom
+
+        for line in wrap(text, font, WIDTH * zoom - x - PADDING * zoom):
+            lines.append((x, y, line, font, style.color))
+            y += style.size * zoom * LINE_SPACING
+
+    image = Image.new("RGB", (WIDTH * zoom, round(y + PADDING * zoom)), image_tools.WHITE)
+    draw = ImageDraw.Draw(image)
+    for x, y, line, font, color in lines:
+        draw.text((x, y), line, fill=color, font=font)
+
+    # the card is as wide as its longest line, like the screenshots
+    image = image_tools.trim(image, image_tools.WHITE, sides=("right",), pad=5 * zoom)
+
+    out = io.BytesIO()
+    image.save(out, format="png")
+    return out.getvalue()
+
+
+def render(word: "Word", zoom=3) -> bytes:
+    with log(f"Drawing the card of {word.get_display_name()!r}"):
+        return render_card(word.get_display_name(), word.ipa, word.part_of_speech, word.meaning, word.example, zoom)
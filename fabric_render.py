@@ -0,0 +1,406 @@
+"""
+Draws the fabric.js canvas JSON of PosterMyWall templates (what Template.get_objects caches) with Pillow, so text
+changes can be rendered without a browser. Only what templates commonly use is drawn: images, rects and texts, also
+inside groups. Everything else raises UnsupportedObject, the caller should fall back to the browser then.
+
+Positions and text metrics follow fabric 1.x, the version the editor uses (it still has setText).
+"""
+import base64
+import copy
+import functools
+import io
+import math
+import os
+import re
+from typing import Iterable, Union
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# font files named after the family, with a Bold, Italic or BoldItalic suffix for the styles, e.g. "Lato-Bold.ttf"
+FONT_DIR = "fonts/postermywall"
+FONT_EXTENSIONS = (".ttf", ".otf")
+STYLE_SUFFIXES = {(False, False): ("", "regular"),
+                  (True, False): ("bold",),
+                  (False, True): ("italic", "oblique"),
+                  (True, True): ("bolditalic", "boldoblique")}
+
+# fabric.Text
+FONT_SIZE_MULT = 1.13
+FONT_SIZE_FRACTION = 0.25
+DEFAULT_LINE_HEIGHT = 1.16
+
+TEXT_TYPES = {"text", "i-text", "textbox"}
+ORIGINS = {"left": -.5, "top": -.5, "center": 0, "right": .5, "bottom": .5}
+
+# properties that change how an object looks but aren't drawn here -> values that are fine
+UNSUPPORTED_PROPERTIES = {
+    "clipTo": (None,),
+    "clipPath": (None,),
+    "shadow": (None,),
+    "skewX": (None, 0),
+    "skewY": (None, 0),
+    "filters": (None, []),
+    "globalCompositeOperation": (None, "source-over"),
+    "textDecoration": (None, ""),
+    "underline": (None, False),
+    "overline": (None, False),
+    "linethrough": (None, False),
+    "textBackgroundColor": (None, ""),
+    "charSpacing": (None, 0),
+    "styles": (None, {}),
+}
+
+# (a, b, c, d, e, f) like canvas transforms: x' = a*x + c*y + e, y' = b*x + d*y + f
+Matrix = tuple[float, float, float, float, float, float]
+IDENTITY: Matrix = (1, 0, 0, 1, 0, 0)
+
+
+class UnsupportedObject(Exception):
+    ...
+
+
+def multiply(m: Matrix, n: Matrix) -> Matrix:
+    """m after n"""
+    a1, b1, c1, d1, e1, f1 = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a1 * a2 + c1 * b2, b1 * a2 + d1 * b2,
+            a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+            a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+
+def invert(m: Matrix) -> Matrix:
+    a, b, c, d, e, f = m
+    det = a * d - b * c
+    return d / det, -b / det, -c / det, a / det, (c * f - d * e) / det, (b * e - a * f) / det
+
+
+def transform_point(m: Matrix, x: float, y: float) -> tuple[float, float]:
+    return m[0] * x + m[2] * y + m[4], m[1] * x + m[3] * y + m[5]
+
+
+def parse_color(value) -> Union[tuple[int, int, int, int], None]:
+    """RGBA of a css color, None for no color."""
+    if value in (None, "", "transparent", "none"):
+        return None
+    if not isinstance(value, str):
+        raise UnsupportedObject(f"Fill {value!r}")
+
+    # Pillow wants the alpha of rgba() as 0-255, css has it as 0-1
+    if match := re.fullmatch(r"rgba\(\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*\)", value.strip()):
+        *rgb, alpha = match.groups()
+        return *(round(float(channel)) for channel in rgb), round(float(alpha) * 255)
+
+    try:
+        return ImageColor.getcolor(value.strip(), "RGBA")
+    except ValueError as e:
+        raise UnsupportedObject(f"Color {value!r}") from e
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+@functools.lru_cache(maxsize=None)
+def find_font_file(family: str, bold: bool, italic: bool, font_dirs: tuple[str, ...]) -> str:
+    # the first family of a css font list
+    family = normalize_name(family.split(",")[0].strip().strip("'\""))
+    wanted = {family + suffix for suffix in STYLE_SUFFIXES[bold, italic]}
+
+    for font_dir in font_dirs:
+        if not os.path.isdir(font_dir):
+            continue
+
+        for file_name in sorted(os.listdir(font_dir)):
+            name, extension = os.path.splitext(file_name)
+            if extension.lower() in FONT_EXTENSIONS and normalize_name(name) in wanted:
+                return os.path.join(font_dir, file_name)
+
+    # the browser would have a font or fake the style
+    raise UnsupportedObject(f"No font file for {family!r} (bold: {bold}, italic: {italic}) in {font_dirs}")
+
+
+@functools.lru_cache(maxsize=256)
+def get_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, max(1, size))
+
+
+def check_supported(object_: dict):
+    for property_, fine in UNSUPPORTED_PROPERTIES.items():
+        if object_.get(property_) not in fine:
+            raise UnsupportedObject(f"{object_.get('type')!r} with {property_}={object_[property_]!r}")
+
+
+def get_text_font(object_: dict, scale: float, font_dirs: tuple[str, ...]) -> ImageFont.FreeTypeFont:
+    weight = str(object_.get("fontWeight", "normal"))
+    bold = weight in ("bold", "bolder") or (weight.isdigit() and int(weight) >= 600)
+    italic = object_.get("fontStyle", "normal") in ("italic", "oblique")
+
+    path = find_font_file(object_.get("fontFamily", "Times New Roman"), bold, italic, font_dirs)
+    return get_font(path, round(object_.get("fontSize", 40) * scale))
+
+
+def wrap(text: str, font: ImageFont.FreeTypeFont, max_width: float) -> list[str]:
+    """Greedy word wrap like fabric.Textbox, words longer than a line stay whole."""
+    lines = []
+    for paragraph in text.split("\n"):
+        line = None
+        for word in paragraph.split(" "):
+            candidate = word if line is None else f"{line} {word}"
+            if line is not None and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line or "")
+    return lines
+
+
+def layout_text(object_: dict, font_dirs: tuple[str, ...]) -> dict:
+    """
+    Copy of the text object with its lines and with width and height measured again like fabric does after setText,
+    in design pixels.
+    """
+    font = get_text_font(object_, 1, font_dirs)
+    text = object_.get("text", "")
+
+    if object_.get("type") == "textbox":
+        lines = wrap(text, font, object_["width"])
+        width = object_["width"]
+    else:
+        lines = text.split("\n")
+        width = max(font.getlength(line) for line in lines)
+
+    line_height = object_.get("fontSize", 40) * FONT_SIZE_MULT * object_.get("lineHeight", DEFAULT_LINE_HEIGHT)
+    # the last line isn't followed by line spacing
+    height = line_height * (len(lines) - 1) + object_.get("fontSize", 40) * FONT_SIZE_MULT
+
+    return {**object_, "width": width, "height": height, "_lines": lines}
+
+
+def get_dimensions(object_: dict) -> tuple[float, float]:
+    """Width and height without transformations, with the stroke."""
+    stroke_width = object_.get("strokeWidth", 0) if object_.get("stroke") else 0
+    return object_.get("width", 0) + stroke_width, object_.get("height", 0) + stroke_width
+
+
+def get_matrix(object_: dict) -> Matrix:
+    """From the object's own space (centered at 0, 0) to its parent's."""
+    width, height = get_dimensions(object_)
+    scale_x, scale_y = object_.get("scaleX", 1), object_.get("scaleY", 1)
+
+    angle = math.radians(object_.get("angle", 0))
+    cos, sin = math.cos(angle), math.sin(angle)
+
+    origin_x = ORIGINS.get(object_.get("originX", "left"), object_.get("originX"))
+    origin_y = ORIGINS.get(object_.get("originY", "top"), object_.get("originY"))
+    if not isinstance(origin_x, (int, float)) or not isinstance(origin_y, (int, float)):
+        raise UnsupportedObject(f"Origin {object_.get('originX')!r}, {object_.get('originY')!r}")
+
+    # left and top are of the origin point, the rotation is around the center
+    offset_x, offset_y = -origin_x * width * scale_x, -origin_y * height * scale_y
+    center_x = object_.get("left", 0) + offset_x * cos - offset_y * sin
+    center_y = object_.get("top", 0) + offset_x * sin + offset_y * cos
+
+    scale_x *= -1 if object_.get("flipX") else 1
+    scale_y *= -1 if object_.get("flipY") else 1
+    return cos * scale_x, sin * scale_x, -sin * scale_y, cos * scale_y, center_x, center_y
+
+
+def get_size(data: dict) -> tuple[float, float]:
+    """Design size of the canvas, saved with the objects or else the box around all of them."""
+    if data.get("width") and data.get("height"):
+        return data["width"], data["height"]
+
+    right = bottom = 1
+    for object_ in [data.get("backgroundImage"), *data.get("objects", [])]:
+        if not object_:
+            continue
+
+        width, height = get_dimensions(object_)
+        matrix = get_matrix(object_)
+        for x, y in ((-width / 2, -height / 2), (width / 2, -height / 2), (-width / 2, height / 2),
+                     (width / 2, height / 2)):
+            point_x, point_y = transform_point(matrix, x, y)
+            right, bottom = max(right, point_x), max(bottom, point_y)
+
+    return right, bottom
+
+
+def load_image(images: dict[str, bytes], src: str) -> Image.Image:
+    if src.startswith("data:"):
+        data = base64.b64decode(src.split(",", 1)[1])
+    elif src in images:
+        data = images[src]
+    else:
+        raise UnsupportedObject(f"Image {src!r} wasn't downloaded")
+
+    # open is lazy, load decodes it so formats pillow can't read (e.g. svg) or truncated downloads fail here
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except OSError as e:
+        raise UnsupportedObject(f"Image {src[:100]!r} can't be decoded: {e}") from e
+    return image
+
+
+def draw_image(object_: dict, size: tuple[int, int], images: dict[str, bytes]) -> Image.Image:
+    image = load_image(images, object_.get("src", "")).convert("RGBA")
+
+    # fabric stretches the (cropped) element to width x height
+    crop_x, crop_y = object_.get("cropX", 0), object_.get("cropY", 0)
+    if crop_x or crop_y:
+        image = image.crop((crop_x, crop_y, crop_x + object_["width"], crop_y + object_["height"]))
+    return image.resize(size, Image.LANCZOS)
+
+
+def draw_rect(object_: dict, size: tuple[int, int], scale: float) -> Image.Image:
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+
+    stroke = parse_color(object_.get("stroke"))
+    stroke_width = round(object_.get("strokeWidth", 0) * scale) if stroke else 0
+    # the stroke is centered on the edge of the rect
+    inset = stroke_width / 2
+    box = (inset, inset, size[0] - 1 - inset, size[1] - 1 - inset)
+
+    ImageDraw.Draw(image).rounded_rectangle(box, radius=object_.get("rx", 0) * scale,
+                                            fill=parse_color(object_.get("fill")), outline=stroke, width=stroke_width)
+    return image
+
+
+def draw_text(object_: dict, size: tuple[int, int], scale: float, font_dirs: tuple[str, ...]) -> Image.Image:
+    if object_.get("stroke") and object_.get("strokeWidth", 0):
+        raise UnsupportedObject("Text with a stroke")
+
+    align = object_.get("textAlign", "left")
+    if align not in ("left", "center", "right"):
+        raise UnsupportedObject(f"textAlign {align!r}")
+
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    font = get_text_font(object_, scale, font_dirs)
+    fill = parse_color(object_.get("fill", "rgb(0,0,0)"))
+
+    font_size = object_.get("fontSize", 40) * scale
+    line_height = font_size * FONT_SIZE_MULT * object_.get("lineHeight", DEFAULT_LINE_HEIGHT)
+    for i, line in enumerate(object_["_lines"]):
+        offset = {"left": 0, "center": .5, "right": 1}[align] * (size[0] - font.getlength(line))
+        baseline = i * line_height + font_size * FONT_SIZE_MULT - font_size * FONT_SIZE_FRACTION
+        draw.text((offset, baseline), line, fill=fill, font=font, anchor="ls")
+
+    return image
+
+
+def composite(canvas: Image.Image, image: Image.Image, matrix: Matrix, opacity: float):
+    """Draws image onto canvas, matrix maps image pixels to canvas pixels."""
+    corners = [transform_point(matrix, x, y) for x in (0, image.width) for y in (0, image.height)]
+    left = max(0, math.floor(min(x for x, _ in corners)))
+    top = max(0, math.floor(min(y for _, y in corners)))
+    right = min(canvas.width, math.ceil(max(x for x, _ in corners)))
+    bottom = min(canvas.height, math.ceil(max(y for _, y in corners)))
+    if right <= left or bottom <= top:
+        return
+
+    # Pillow wants the other direction: for each pixel of the region, where it is in the image
+    a, b, c, d, e, f = invert(multiply((1, 0, 0, 1, -left, -top), matrix))
+    # premultiplied, so transparent pixels don't bleed their color into the edges
+    region = image.convert("RGBa").transform((right - left, bottom - top), Image.AFFINE, (a, c, e, b, d, f),
+                                             resample=Image.BICUBIC).convert("RGBA")
+    if opacity < 1:
+        region.putalpha(region.getchannel("A").point(lambda value: round(value * opacity)))
+
+    canvas.alpha_composite(region, (left, top))
+
+
+def draw_object(canvas: Image.Image, object_: dict, parent: Matrix, images: dict[str, bytes],
+                font_dirs: tuple[str, ...], opacity: float = 1):
+    if not object_.get("visible", True) or not (opacity := opacity * object_.get("opacity", 1)):
+        return
+
+    type_ = object_.get("type")
+    check_supported(object_)
+
+    if type_ in TEXT_TYPES:
+        object_ = layout_text(object_, font_dirs)
+    matrix = multiply(parent, get_matrix(object_))
+
+    if type_ == "group":
+        for child in object_.get("objects", []):
+            draw_object(canvas, child, matrix, images, font_dirs, opacity)
+        return
+
+    # drawn at the resolution it ends up with, then only rotated and moved
+    width, height = get_dimensions(object_)
+    scale_x, scale_y = math.hypot(matrix[0], matrix[1]), math.hypot(matrix[2], matrix[3])
+    if type_ != "image":
+        # shapes and texts can't be drawn stretched
+        scale_x = scale_y = max(scale_x, scale_y)
+    size = (max(1, math.ceil(width * scale_x)), max(1, math.ceil(height * scale_y)))
+
+    if type_ == "image":
+        image = draw_image(object_, size, images)
+    elif type_ == "rect":
+        image = draw_rect(object_, size, scale_x)
+    elif type_ in TEXT_TYPES:
+        image = draw_text(object_, size, scale_x, font_dirs)
+    else:
+        raise UnsupportedObject(f"Object type {type_!r}")
+
+    # image pixels -> object space (centered) -> canvas
+    to_object = (width / size[0], 0, 0, height / size[1], -width / 2, -height / 2)
+    composite(canvas, image, multiply(matrix, to_object), opacity)
+
+
+def get_image_sources(data: dict) -> set[str]:
+    """URLs of all images the canvas needs, to be downloaded for render."""
+    out = set()
+    for object_ in [data.get("backgroundImage"), *data.get("objects", [])]:
+        if not object_:
+            continue
+        if object_.get("type") == "group":
+            out |= get_image_sources(object_)
+        elif object_.get("type") == "image" and not object_.get("src", "").startswith("data:"):
+            out.add(object_.get("src", ""))
+    return out
+
+
+def set_texts(data: dict, modifications: Iterable[tuple[list[int], str]]) -> dict:
+    """Copy of the canvas JSON with the texts at the paths (see postermywall.get_objects) replaced."""
+    data = copy.deepcopy(data)
+    for path, text in modifications:
+        object_ = data
+        for i in path:
+            if not isinstance(object_.get("objects"), list) or not 0 <= i < len(object_["objects"]):
+                raise UnsupportedObject(f"No object at {path!r}")
+            object_ = object_["objects"][i]
+
+        if object_.get("type") not in TEXT_TYPES:
+            raise UnsupportedObject(f"The object at {path!r} isn't a text")
+        object_["text"] = text
+    return data
+
+
+def render(data: dict, images: dict[str, bytes], multiplier: float = 1, width: int = None, height: int = None,
+           font_dirs: Iterable[str] = (FONT_DIR,)) -> bytes:
+    """PNG of the canvas, sized like postermywall.export. images maps the image URLs to their content."""
+    font_dirs = tuple(font_dirs)
+    if data.get("overlayImage") or data.get("overlayColor"):
+        raise UnsupportedObject("Canvas with an overlay")
+
+    design_width, design_height = get_size(data)
+    scale = multiplier
+    if width:
+        scale = width / design_width
+    elif height:
+        scale = height / design_height
+
+    canvas = Image.new("RGBA", (max(1, round(design_width * scale)), max(1, round(design_height * scale))),
+                       parse_color(data.get("background")) or (0, 0, 0, 0))
+    view = (scale, 0, 0, scale, 0, 0)
+
+    for object_ in [data.get("backgroundImage"), *data.get("objects", [])]:
+        if object_:
+            draw_object(canvas, object_, view, images, font_dirs)
+
+    out = io.BytesIO()
+    canvas.save(out, format="png")
+    return out.getvalue()
@@ -1,28 +1,131 @@
 import os
-from typing import Union
+import threading
+from typing import Iterator, Union
 import pickle
+
+import httpx
+import msgpack
 import requests
 from io import BytesIO
 from bs4 import BeautifulSoup
 import unicodedata
 
+import g2p_deu
+from belissibot_framework import BotError
+from context_logger import log
 from wörterbuch import Word
 
 url = 'https://clarin.phonetik.uni-muenchen.de/BASWebServices/services/runG2P'
 
-
-def save_cache():
-    with open("cache.dat", "wb") as f:
-        pickle.dump(cache, f)
-
-
-if not os.path.exists("cache.dat"):
-    cache = {}
-    save_cache()
-
-else:
-    with open("cache.dat", "rb") as f:
-        cache = pickle.load(f)
+JOURNAL_PATH = "g2p_cache.journal"
+# the whole cache dict used to be pickled into this file on every miss
+LEGACY_CACHE_PATH = "cache.dat"
+
+# words per runG2P request of AsyncG2PClient.g2p_batch
+BATCH_SIZE = 500
+
+# rewrite the journal once it holds this many records per distinct entry
+COMPACTION_FACTOR = 2
+COMPACTION_MIN_RECORDS = 1000
+
+
+class G2PCache:
+    """
+    (word, lng) -> raw BAS output. Every new entry is appended to a msgpack journal, the journal is only read on
+    first use.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH, legacy_path: str = LEGACY_CACHE_PATH):
+        self.path = path
+        self.legacy_path = legacy_path
+
+        self._entries: Union[dict[tuple[str, str], str], None] = None
+        self._records = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        entries = {}
+        if not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "rb") as f:
+                entries = pickle.load(f)
+            self._entries = entries
+            self._rewrite()
+            os.replace(self.legacy_path, f"{self.legacy_path}.migrated")
+            return
+
+        records = 0
+        end = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                unpacker = msgpack.Unpacker(f, use_list=False)
+                try:
+                    for word, lng, output in unpacker:
+                        entries[(word, lng)] = output
+                        records += 1
+                        end = unpacker.tell()
+                except ValueError as e:
+                    log(f"G2P cache journal is corrupt after {records} records, dropping the rest: {e!r}")
+
+        self._entries = entries
+        self._records = records
+        self._file = open(self.path, "ab")
+
+        # a torn last record from a crash mid-write
+        if self._file.tell() != end:
+            self._file.truncate(end)
+            self._file.seek(end)
+
+        if self._records >= COMPACTION_MIN_RECORDS and self._records > COMPACTION_FACTOR * len(self._entries):
+            self._rewrite()
+
+    def _rewrite(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for (word, lng), output in self._entries.items():
+                f.write(msgpack.dumps((word, lng, output)))
+
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+
+        self._file = open(self.path, "ab")
+        self._records = len(self._entries)
+
+    def get(self, word: str, lng: str) -> Union[str, None]:
+        with self._lock:
+            self._load()
+            return self._entries.get((word, lng))
+
+    def put(self, word: str, lng: str, output: str):
+        with self._lock:
+            self._load()
+
+            self._entries[(word, lng)] = output
+            self._file.write(msgpack.dumps((word, lng, output)))
+            self._file.flush()
+            self._records += 1
+
+            if self._records >= COMPACTION_MIN_RECORDS and self._records > COMPACTION_FACTOR * len(self._entries):
+                self._rewrite()
+
+    def items(self) -> Iterator[tuple[tuple[str, str], str]]:
+        with self._lock:
+            self._load()
+            items = list(self._entries.items())
+
+        return iter(items)
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+
+cache = G2PCache()
 
 
 def strip_accents(s):
@@ -31,14 +134,29 @@ def strip_accents(s):
 
 
 def process_response(response: str) -> list[str]:
-    print(response)
     return list(map(lambda x: x.replace(" ", "").replace("+", "").strip(), response.replace("?", "ʔ").split(" ")))
 
 
+class G2PError(BotError):
+    ...
+
+
+def parse_run_response(text: str) -> str:
+    """The download link of a runG2P response."""
+    parsed_html = BeautifulSoup(text, features="lxml")
+
+    if parsed_html.body is None or parsed_html.body.find('success') is None:
+        raise G2PError(f"Unexpected response from the G2P service: `{text[:500]}`")
+    if parsed_html.body.find('success').text != "true":
+        output = parsed_html.body.find('output')
+        raise G2PError(f"The G2P service failed: `{(output.text if output else text)[:1500]}`")
+
+    return parsed_html.body.find('downloadlink').text
+
+
 def g2p(word, lng):
-    query = (word, lng)
-    if query in cache:
-        return process_response(cache[query])
+    if (outstr := cache.get(word, lng)) is not None:
+        return process_response(outstr)
 
     multiple_files = [
         ('i', ('text.txt', BytesIO(word.encode()))),
@@ -49,27 +167,93 @@ def g2p(word, lng):
     ]
     r = requests.post(url, files=multiple_files)
 
-    parsed_html = BeautifulSoup(r.text, features="lxml")
-    assert parsed_html.body.find('success').text == "true", f"Something went wrong: {parsed_html}"
-    download_link = parsed_html.body.find('downloadlink').text
+    download_link = parse_run_response(r.text)
 
     outstr = requests.get(download_link).content.decode("utf-8")
 
-    cache.update({query: outstr})
-    save_cache()
+    cache.put(word, lng, outstr)
 
     return process_response(outstr)
 
 
+class AsyncG2PClient:
+    """
+    runG2P over one pooled httpx connection. g2p_batch uploads many words as one multi-line text.txt, BAS answers
+    with one aligned line per input line.
+    """
+
+    def __init__(self, service_url: str = url, timeout: float = 60, g2p_cache: G2PCache = None,
+                 max_connections: int = 4):
+        self.url = service_url
+        self.cache = cache if g2p_cache is None else g2p_cache
+        self.client = httpx.AsyncClient(timeout=timeout,
+                                        limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections))
+
+    async def _run(self, text: str, lng: str) -> str:
+        multiple_files = [
+            ('i', ('text.txt', text.encode())),
+            ('lng', (None, lng.encode())),
+            ('outsym', (None, "ipa".encode())),
+            ('oform', (None, "txt".encode())),
+            ('align', (None, "yes".encode()))
+        ]
+        r = await self.client.post(self.url, files=multiple_files)
+        r.raise_for_status()
+
+        download = await self.client.get(parse_run_response(r.text))
+        download.raise_for_status()
+
+        return download.content.decode("utf-8")
+
+    async def g2p(self, word: str, lng: str) -> list[str]:
+        return (await self.g2p_batch([word], lng))[0]
+
+    async def g2p_batch(self, words: list[str], lng: str) -> list[list[str]]:
+        for word in words:
+            if not word.strip() or "\n" in word:
+                raise G2PError(f"Can't transcribe {word!r}, words have to be non-empty and on a single line.")
+
+        missing = list(dict.fromkeys(word for word in words if self.cache.get(word, lng) is None))
+
+        for i in range(0, len(missing), BATCH_SIZE):
+            chunk = missing[i:i + BATCH_SIZE]
+
+            lines = [line for line in (await self._run("\n".join(chunk), lng)).splitlines() if line.strip()]
+            if len(lines) != len(chunk):
+                raise G2PError(f"The G2P service returned {len(lines)} lines for {len(chunk)} words.")
+
+            for word, line in zip(chunk, lines):
+                self.cache.put(word, lng, line)
+
+        return [process_response(self.cache.get(word, lng)) for word in words]
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+async_client = AsyncG2PClient()
+
+# languages with a local rule-based engine, used before asking BAS
+LOCAL_ENGINES = {"deu": g2p_deu.transcribe}
+
+
+async def transcribe(word: str, lng: str) -> list[str]:
+    """Aligned phonemes of word, from the local rules if they can handle it, otherwise from BAS."""
+    if (engine := LOCAL_ENGINES.get(lng)) is not None and (phonemes := engine(word)) is not None:
+        return phonemes
+
+    return await async_client.g2p(word, lng)
+
+
 VOWELS = "ɯəʏuʌɑʉyɤɞɪøɒoʊɵeɔœiaɶɨɜæɛɐɘaeiouAEIOU"
+VOWEL_SET = frozenset(VOWELS)
 
 
 def has_vowels(syllable: Union[list[str], str]):
-    for phonemes in syllable:
-        for phoneme in phonemes:
-            if phoneme in VOWELS:
-                return True
-    return False
+    if isinstance(syllable, str):
+        return not VOWEL_SET.isdisjoint(syllable)
+    return any(not VOWEL_SET.isdisjoint(phonemes) for phonemes in syllable)
 
 
 def get_syllables(phonemes: list[str], word: str):
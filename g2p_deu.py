@@ -0,0 +1,225 @@
+"""
+Rule-based German grapheme to phoneme conversion. transcribe() returns the same aligned output as BAS runG2P with
+align=yes: one phoneme string per character of the word, "_" for characters that belong to the phoneme before.
+"""
+from typing import Union
+
+LETTERS = frozenset("abcdefghijklmnopqrstuvwxyzäöüß")
+VOWEL_LETTERS = frozenset("aeiouäöüy")
+
+LONG_VOWELS = {"a": "aː", "e": "eː", "i": "iː", "o": "oː", "u": "uː", "ä": "ɛː", "ö": "øː", "ü": "yː", "y": "yː"}
+SHORT_VOWELS = {"a": "a", "e": "ɛ", "i": "ɪ", "o": "ɔ", "u": "ʊ", "ä": "ɛ", "ö": "œ", "ü": "ʏ", "y": "ʏ"}
+
+# vowel digraphs, always one phoneme
+VOWEL_GRAPHS = {"ie": "iː", "ei": "aɪ", "ai": "aɪ", "ey": "aɪ", "ay": "aɪ", "eu": "ɔʏ", "äu": "ɔʏ", "au": "aʊ",
+                "aa": "aː", "ee": "eː", "oo": "oː"}
+
+# consonant graphs, longest first
+CONSONANT_GRAPHS = {"tsch": "tʃ", "sch": "ʃ", "chs": "ks", "ck": "k", "ph": "f", "qu": "kv", "ng": "ŋ", "th": "t",
+                    "dt": "t", "tz": "ts", "ss": "s"}
+
+SINGLE_CONSONANTS = {"b": "b", "c": "k", "d": "d", "f": "f", "g": "ɡ", "h": "h", "j": "j", "k": "k", "l": "l",
+                     "m": "m", "n": "n", "p": "p", "q": "k", "r": "ʁ", "s": "s", "t": "t", "v": "f", "w": "v",
+                     "x": "ks", "z": "ts", "ß": "s"}
+
+DEVOICED = {"b": "p", "d": "t", "g": "k", "ɡ": "k", "z": "s"}
+
+# endings whose e is unstressed (schwa)
+SCHWA_ENDINGS = ("e", "en", "el", "em", "es", "et", "est", "ern", "eln", "end", "ens", "er", "ers")
+UNSTRESSED_PREFIXES = ("be", "ge")
+
+# words the rules get wrong, aligned like the output ("_" for merged characters, separated by spaces)
+EXCEPTIONS = {
+    "ab": "a p",
+    "an": "a n",
+    "am": "a m",
+    "in": "ɪ n",
+    "im": "ɪ m",
+    "um": "ʊ m",
+    "es": "ɛ s",
+    "das": "d a s",
+    "was": "v a s",
+    "des": "d ɛ s",
+    "mit": "m ɪ t",
+    "hat": "h a t",
+    "bis": "b ɪ s",
+    "ob": "ɔ p",
+    "von": "f ɔ n",
+    "vom": "f ɔ m",
+    "man": "m a n",
+    "und": "ʊ n t",
+    "ist": "ɪ s t",
+    "der": "d eː ɐ",
+    "er": "eː ɐ",
+    "wer": "v eː ɐ",
+    "hier": "h iː _ ɐ",
+    "vier": "f iː _ ɐ",
+    "mir": "m iː ɐ",
+    "dir": "d iː ɐ",
+    "wir": "v iː ɐ",
+    "ihr": "iː _ ɐ",
+    "chef": "ʃ _ ɛ f",
+    "chance": "ʃ _ ã s _ ə",
+    "chor": "k _ oː ɐ",
+    "chaos": "k _ aː ɔ s",
+    "china": "ç _ iː n a",
+    "chemie": "ç _ e m iː _",
+    "computer": "k ɔ m p juː t ɐ _",
+    "baby": "b eː b iː",
+    "job": "dʒ ɔ p",
+    "team": "t iː _ m",
+    "cool": "k uː _ l",
+    "vase": "v aː z ə",
+    "video": "v iː d e oː",
+    "villa": "v ɪ l _ a",
+    "vulkan": "v ʊ l k aː n",
+    "klavier": "k l a v iː _ ɐ",
+    "november": "n o v ɛ m b ɐ _",
+    "hotel": "h o t ɛ l",
+    "büro": "b y ʁ oː",
+    "garage": "ɡ a ʁ aː ʒ ə",
+    "orange": "o ʁ ã _ ʒ ə",
+    "genie": "ʒ e n iː _",
+    "journalist": "ʒ _ ʊ ʁ n a l ɪ s t",
+}
+
+for _word, _phonemes in EXCEPTIONS.items():
+    assert len(_phonemes.split(" ")) == len(_word), f"Exception {_word!r} is not aligned: {_phonemes!r}"
+
+
+def _is_vowel(word: str, i: int) -> bool:
+    return 0 <= i < len(word) and word[i] in VOWEL_LETTERS
+
+
+def _vowel_count(word: str) -> int:
+    # vowel groups, "ie", "ei", ... count once
+    return sum(1 for i, char in enumerate(word) if char in VOWEL_LETTERS and not _is_vowel(word, i - 1))
+
+
+def _consonants_after(word: str, i: int) -> int:
+    n = 0
+    while i + n < len(word) and word[i + n] not in VOWEL_LETTERS:
+        n += 1
+    return n
+
+
+def _is_schwa(word: str, i: int) -> bool:
+    if word[i] != "e" or _vowel_count(word) < 2:
+        return False
+
+    if any(word.endswith(ending) and i == len(word) - len(ending) for ending in SCHWA_ENDINGS):
+        return True
+
+    # only in words that have a stressed syllable left after the prefix ("gefahren", not "geben")
+    return _vowel_count(word) >= 3 and any(word.startswith(prefix) and i == len(prefix) - 1
+                                           and not _is_vowel(word, i + 1) and word[i + 1] != "h"
+                                           for prefix in UNSTRESSED_PREFIXES)
+
+
+def _vowel(word: str, i: int) -> tuple[str, int]:
+    char = word[i]
+
+    if (graph := word[i:i + 2]) in VOWEL_GRAPHS:
+        return VOWEL_GRAPHS[graph], 2
+
+    if _is_schwa(word, i):
+        # vocalic r: "-er", "-ern", ...
+        if word[i + 1:i + 2] == "r" and not _is_vowel(word, i + 2):
+            return "ɐ", 2
+        return "ə", 1
+
+    # a silent h lengthens the vowel
+    if word[i + 1:i + 2] == "h":
+        return LONG_VOWELS[char], 2
+
+    consonants = _consonants_after(word, i + 1)
+    if consonants == 0:
+        return LONG_VOWELS[char], 1
+    if consonants == 1 and word[i + 1] != "x":
+        # a single final consonant is ambiguous, short in longer words ("Ergebnis"), long otherwise ("gut")
+        if i + 2 >= len(word) and _vowel_count(word) > 1:
+            return SHORT_VOWELS[char], 1
+        return LONG_VOWELS[char], 1
+    if word[i + 1:i + 3] == "ch" and consonants == 2 and char in "uo" and _vowel_count(word) == 1:
+        return LONG_VOWELS[char], 1
+
+    return SHORT_VOWELS[char], 1
+
+
+def _devoice(word: str, i: int, length: int) -> bool:
+    # final devoicing: at the end of the word or before another obstruent
+    after = i + length
+    return after >= len(word) or (word[after] not in VOWEL_LETTERS and word[after] not in "lrnmjh")
+
+
+def _consonant(word: str, i: int) -> tuple[str, int]:
+    char = word[i]
+
+    if i == 0 and word[:2] in ("sp", "st"):
+        return "ʃ", 1
+
+    if word[i:i + 2] == "ch":
+        if word[i:i + 3] == "chs":
+            return CONSONANT_GRAPHS["chs"], 3
+        back = i > 0 and word[i - 1] in "aou" and not word[i - 2:i] in ("eu", "äu")
+        return ("x" if back else "ç"), 2
+
+    if char == "g" and i > 0 and word[i - 1] == "i" and i + 1 == len(word):
+        return "ç", 1
+
+    if word[i:i + 2] == "nk":
+        return "ŋ", 1
+
+    for graph, phoneme in CONSONANT_GRAPHS.items():
+        if word.startswith(graph, i):
+            return phoneme, len(graph)
+
+    # doubled consonants are one phoneme
+    if i + 1 < len(word) and word[i + 1] == char:
+        phoneme = SINGLE_CONSONANTS[char]
+        return (DEVOICED.get(char, phoneme) if _devoice(word, i, 2) else phoneme), 2
+
+    if char == "c":
+        return ("ts" if word[i + 1:i + 2] in ("e", "i", "ä") else "k"), 1
+
+    if char == "s" and _is_vowel(word, i + 1) and (i == 0 or _is_vowel(word, i - 1) or word[i - 1] in "lmnr"):
+        return "z", 1
+
+    if char == "r" and i > 0 and _is_vowel(word, i - 1) and not _is_vowel(word, i + 1):
+        return "ɐ", 1
+
+    if char == "h" and i > 0 and _is_vowel(word, i - 1):
+        return "_", 1
+
+    phoneme = SINGLE_CONSONANTS[char]
+    if char in DEVOICED and _devoice(word, i, 1):
+        return DEVOICED[char], 1
+    return phoneme, 1
+
+
+def transcribe(word: str) -> Union[list[str], None]:
+    """Aligned phonemes of word, None if it can't be handled by the rules (e.g. foreign characters)."""
+    word = word.lower()
+
+    if not word or not set(word) <= LETTERS:
+        return None
+
+    if word in EXCEPTIONS:
+        return EXCEPTIONS[word].split(" ")
+
+    out = []
+    i = 0
+    while i < len(word):
+        try:
+            if word[i] in VOWEL_LETTERS:
+                phoneme, length = _vowel(word, i)
+            else:
+                phoneme, length = _consonant(word, i)
+        except KeyError:
+            # a spelling the rules have no mapping for, left to BAS
+            return None
+
+        out += [phoneme] + ["_"] * (length - 1)
+        i += length
+
+    return out
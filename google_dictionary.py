@@ -1,23 +1,72 @@
+import base64
+import dataclasses
 import io
+import weakref
 from PIL import Image, PngImagePlugin
 from io import BytesIO
 import selenium.common.exceptions
-from selenium.webdriver import ActionChains
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webelement import WebElement
 
 import cachelib
+import image_tools
 from context_logger import log
 
 
-def get_image(webdriver: WebDriver, word, ipa, part_of_speech, meaning, example, zoom=3):
-    hash_obj = (word, ipa, part_of_speech, meaning, example, zoom)
+cachelib.register_namespace("dictionary")
+
+BASE_URL = "https://www.google.de/search?q=laufen+definition"
+
+
+def get_hash_obj(word, ipa, part_of_speech, meaning, example, zoom=3):
+    return "dictionary", word, ipa, part_of_speech, meaning, example, zoom
+
+
+# the card's text elements, relative to the frame
+FIELD_XPATHS = {"word": "div/div[1]/div[2]/div[1]/div/span",
+                "ipa": "div/div[1]/div[2]/div[2]/span/span",
+                "part_of_speech": "div/div[3]/div/div/div/div/div/i/span",
+                "meaning": "div/div[3]/div/div/ol/li[1]/div/div/div[1]/div[2]/div/div/div[1]/span",
+                "example": "div/div[3]/div/div/ol/li[1]/div/div/div[1]/div[2]/div/div/div[2]/div"}
+
+# sets the text of all fields at once and returns the frame's box in page coordinates, the texts are passed as
+# arguments so quotes in them can't break the script
+UPDATE_SCRIPT = """
+const [frame, changes] = arguments;
+for (const [xpath, text] of changes) {
+    const element = document.evaluate(xpath, frame, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (element === null) {
+        throw new Error("Dictionary card element not found: " + xpath);
+    }
+    element.innerText = text;
+}
+const rect = frame.getBoundingClientRect();
+return [rect.left + window.scrollX, rect.top + window.scrollY, rect.width, rect.height];
+"""
+
+
+@dataclasses.dataclass
+class PreparedPage:
+    url: str
+    frame: WebElement
+
+
+# the dictionary page of each browser, consented, sized, zoomed and with the card element found
+_pages: weakref.WeakKeyDictionary[WebDriver, PreparedPage] = weakref.WeakKeyDictionary()
+
 
-    if data := cachelib.get(hash_obj):
-        return data
+def _is_fresh(webdriver: WebDriver, page: PreparedPage) -> bool:
+    try:
+        # other jobs navigate the same browser, a stale frame means the page was left or reloaded
+        return webdriver.execute_script("return arguments[0].isConnected && location.href;", page.frame) == page.url
+    except selenium.common.exceptions.WebDriverException:
+        return False
 
+
+def _load_page(webdriver: WebDriver) -> PreparedPage:
     with log("Calling google for base site"):
-        webdriver.get("https://www.google.de/search?q=laufen+definition")
+        webdriver.get(BASE_URL)
 
     with log("Click on the agree button"):
         try:
@@ -31,76 +80,71 @@ def get_image(webdriver: WebDriver, word, ipa, part_of_speech, meaning, example,
     with log("Finding the base dictionary element"):
         frame = webdriver.find_element(By.CLASS_NAME, "lr_container").find_elements(By.XPATH, "./*")[2]
 
-    example = f'"{example}"'
-    pad = 5 * zoom
+    # the zoom is applied by the capture, the page is laid out at its normal size
+    log("Resizing window")
+    webdriver.set_window_size(1600, 900)
+    webdriver.execute_script("document.body.style.zoom='1'")
 
-    xpaths_changes = {"div/div[1]/div[2]/div[1]/div/span": word,
-                      "div/div[1]/div[2]/div[2]/span/span": ipa,
-                      "div/div[3]/div/div/div/div/div/i/span": part_of_speech,
-                      "div/div[3]/div/div/ol/li[1]/div/div/div[1]/div[2]/div/div/div[1]/span": meaning,
-                      "div/div[3]/div/div/ol/li[1]/div/div/div[1]/div[2]/div/div/div[2]/div": example}
+    return PreparedPage(webdriver.execute_script("return location.href;"), frame)
 
-    with log("Changing text"):
-        for xpath in xpaths_changes:
-            change = xpaths_changes[xpath]
-            log(f"{change!r}")
 
-            element = frame.find_element(By.XPATH, xpath)
-            # change text of element
-            webdriver.execute_script(f"arguments[0].innerText = '{change}'", element)
+def get_page(webdriver: WebDriver) -> PreparedPage:
+    """The browser's prepared dictionary page, loaded again if it is gone."""
+    page = _pages.get(webdriver)
+    if page is not None and _is_fresh(webdriver, page):
+        log("Reusing the prepared page ♻️")
+        return page
+
+    with log("Preparing the dictionary page"):
+        page = _pages[webdriver] = _load_page(webdriver)
+    return page
 
-    log("Resizing window")
-    webdriver.set_window_size(1600 * zoom, 900 * zoom)
 
-    log("Scaling window")
-    webdriver.execute_script(f"document.body.style.zoom='{zoom}'")
+def capture(webdriver: WebDriver, word, ipa, part_of_speech, meaning, example, zoom=3) -> tuple[bytes, int]:
+    """The browser half of get_image: a screenshot of just the dictionary card, zoom times the size, and the padding."""
+    frame = get_page(webdriver).frame
+    texts = {"word": word, "ipa": ipa, "part_of_speech": part_of_speech, "meaning": meaning, "example": f'"{example}"'}
 
-    log("Scrolling frame into view")
-    ActionChains(webdriver).move_to_element(frame).perform()
-    # driver.execute_script("arguments[0].scrollIntoView(true);", frame)
+    with log("Changing text"):
+        log(f"{texts!r}")
+        left, top, width, height = webdriver.execute_script(
+            UPDATE_SCRIPT, frame, [[FIELD_XPATHS[field], text] for field, text in texts.items()])
 
+    # in css pixels, the capture scales it with the rest
+    pad = 5
     with log("Taking screenshot"):
-        location = frame.location
-        size = frame.size
-        log("Getting png")
-        png = webdriver.get_screenshot_as_png()  # saves screenshot of entire page
-        png = webdriver.get_screenshot_as_png()  # saves screenshot of entire page
+        screenshot = webdriver.execute_cdp_cmd("Page.captureScreenshot", {
+            "format": "png",
+            "captureBeyondViewport": True,
+            "clip": {"x": left - pad, "y": top - pad, "width": width + 2 * pad, "height": height + 2 * pad,
+                     "scale": zoom}
+        })
 
+    return base64.b64decode(screenshot["data"]), pad * zoom
+
+
+def postprocess(screenshot: tuple[bytes, int]) -> bytes:
+    """The PIL half of get_image, needs no browser: trims the white right of the card."""
+    png, pad = screenshot
+
+    with log("Post-processing screenshot"):
         log("Opening with PIL")
         # noinspection PyTypeChecker
         im: PngImagePlugin.PngImageFile = Image.open(BytesIO(png))
 
-        left = location['x'] * zoom - pad
-        top = location['y'] * zoom - pad
-        right = (location['x'] + size['width']) * zoom + pad
-        bottom = (location['y'] + size['height']) * zoom + pad
-
-        log("Cropping")
-        im = im.crop((left, top, right, bottom))
-
-        log("Searching for black")
-        white = (255, 255, 255, 255)
-        for x in range(im.width - 1, -1, -1):
-            for y in range(0, im.height):
-                if im.getpixel((x, y)) != white:
-                    break
-            else:
-                continue
-            break
-        else:
+        log("Trimming the white on the right")
+        im = image_tools.trim(im, image_tools.WHITE, sides=("right",), pad=pad)
+        if im is None:
             raise Exception("Screenshot is blank, maybe you overdid the zoom?")
 
-        log("Cropping again")
-        im = im.crop((0, 0, x + pad, im.height))
-
         log("Saving")
         img_byte_arr = io.BytesIO()
         im.save(img_byte_arr, format="png")  # saves new cropped image
 
     log("Finished!")
 
-    out = img_byte_arr.getvalue()
+    return img_byte_arr.getvalue()
 
-    cachelib.save(out, hash_obj)
 
-    return out
+def get_image(webdriver: WebDriver, word, ipa, part_of_speech, meaning, example, zoom=3):
+    return postprocess(capture(webdriver, word, ipa, part_of_speech, meaning, example, zoom))
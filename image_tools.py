@@ -0,0 +1,70 @@
+"""
+Pillow helpers that stay in Pillow's C code instead of looping over pixels in Python.
+"""
+import functools
+from typing import Iterable, Union
+
+from PIL import Image, ImageChops
+
+WHITE = (255, 255, 255, 255)
+SIDES = ("left", "top", "right", "bottom")
+
+
+def get_difference_mask(image: Image.Image, background: Union[tuple, int] = WHITE, tolerance: int = 0) -> Image.Image:
+    """"L" image, non-zero where any band of image differs from background by more than tolerance."""
+    difference = ImageChops.difference(image, Image.new(image.mode, image.size, background))
+
+    if len(bands := difference.split()) > 1:
+        difference = functools.reduce(ImageChops.lighter, bands)
+
+    if tolerance:
+        difference = difference.point(lambda value: 255 if value > tolerance else 0)
+    return difference
+
+
+def get_content_box(image: Image.Image, background: Union[tuple, int] = WHITE,
+                    tolerance: int = 0) -> Union[tuple[int, int, int, int], None]:
+    """Box around everything that isn't background, None if there is nothing."""
+    return get_difference_mask(image, background, tolerance).getbbox()
+
+
+def trim(image: Image.Image, background: Union[tuple, int] = WHITE, tolerance: int = 0,
+         sides: Iterable[str] = SIDES, pad: int = 0) -> Union[Image.Image, None]:
+    """
+    Crops the background off the given sides, leaving pad pixels of it (as far as the image has them). None if the
+    image is all background.
+    """
+    if (box := get_content_box(image, background, tolerance)) is None:
+        return None
+
+    sides = set(sides)
+    assert sides <= set(SIDES), f"Unknown sides: {sides - set(SIDES)}"
+
+    left, top, right, bottom = box
+    return image.crop((max(0, left - pad) if "left" in sides else 0,
+                       max(0, top - pad) if "top" in sides else 0,
+                       min(image.width, right + pad) if "right" in sides else image.width,
+                       min(image.height, bottom + pad) if "bottom" in sides else image.height))
+
+
+def compare(a: Image.Image, b: Image.Image, background: Union[tuple, int] = WHITE,
+            tolerance: int = 0) -> tuple[float, float, Image.Image]:
+    """
+    (share of pixels that differ by more than tolerance, mean difference 0-255, "L" difference image). The images are
+    compared in RGB, the smaller one is extended with background.
+    """
+    size = (max(a.width, b.width), max(a.height, b.height))
+
+    canvases = []
+    for image in (a, b):
+        canvas = Image.new("RGB", size, background)
+        canvas.paste(image.convert("RGB"), (0, 0))
+        canvases.append(canvas)
+
+    difference = functools.reduce(ImageChops.lighter, ImageChops.difference(*canvases).split())
+
+    histogram = difference.histogram()
+    pixels = size[0] * size[1]
+    share = sum(histogram[tolerance + 1:]) / pixels
+    mean = sum(value * count for value, count in enumerate(histogram)) / pixels
+    return share, mean, difference
@@ -0,0 +1,199 @@
+"""
+Syllabification of IPA transcriptions and an index of dictionary words by rhyme and by approximate pronunciation.
+"""
+import collections
+import dataclasses
+from typing import Iterable
+
+# phoneme classes of single IPA characters
+VOWEL, CONSONANT, STRESS, BOUNDARY, MODIFIER = "V", "C", "S", "B", "M"
+
+PHONEME_CLASSES: dict[str, str] = {}
+for _char in "aeiouyæɐɑɒɔəɘɛɜɞɤɨɪɯɵøœɶʉʊʌʏAEIOUãõẽ":
+    PHONEME_CLASSES[_char] = VOWEL
+for _char in "bcdfghjklmnpqrstvwxzçðŋɟɡɣɦɫɬɭɮɰɱɲɳɴɸɹɺɻɽɾʀʁʂʃʈʋʍʎʐʑʒʔʕʝʟθχ":
+    PHONEME_CLASSES[_char] = CONSONANT
+for _char in "ˈˌ'´`":
+    PHONEME_CLASSES[_char] = STRESS
+for _char in ".·- ":
+    PHONEME_CLASSES[_char] = BOUNDARY
+for _char in "ːˑ̯̩̃͡‿ʰʲʷ":
+    PHONEME_CLASSES[_char] = MODIFIER
+
+# written as two characters but one phoneme
+MULTI_CHAR_PHONEMES = ("aɪ", "aʊ", "ɔʏ", "ɔɪ", "eɪ", "oʊ", "əʊ", "ɪə", "eə", "ʊə", "ts", "tʃ", "dʒ", "pf")
+
+# two consonant onsets, everything else is split between the syllables
+ONSETS = frozenset(("ʃt", "ʃp", "ʃv", "ʃm", "ʃn", "ʃl", "ʃʁ", "pl", "bl", "kl", "ɡl", "fl", "pʁ", "bʁ", "tʁ", "dʁ",
+                    "kʁ", "ɡʁ", "fʁ", "kv", "tsv", "pr", "br", "tr", "dr", "kr", "ɡr", "fr", "st", "sp", "sk", "sl",
+                    "sm", "sn", "sw", "tw", "kw"))
+
+# collapsed for near-homophone matching: voicing pairs, vowel qualities, r variants
+SIMILAR = {"b": "p", "d": "t", "ɡ": "k", "g": "k", "v": "f", "z": "s", "ʒ": "ʃ", "dʒ": "tʃ",
+           "ɛ": "e", "ɪ": "i", "ɔ": "o", "ʊ": "u", "œ": "ø", "ʏ": "y", "ɐ": "ə", "ɑ": "a", "ɒ": "o", "ʌ": "a",
+           "ʁ": "r", "ɹ": "r", "ɾ": "r", "ʀ": "r", "ç": "x"}
+
+EMPTY: frozenset[str] = frozenset()
+
+
+def tokenize(ipa: str) -> list[tuple[str, str]]:
+    """(phoneme, class) pairs, modifiers are attached to the phoneme before them."""
+    out: list[tuple[str, str]] = []
+    i = 0
+    while i < len(ipa):
+        char = ipa[i]
+        class_ = PHONEME_CLASSES.get(char, CONSONANT)
+
+        if class_ == MODIFIER:
+            if out:
+                out[-1] = out[-1][0] + char, out[-1][1]
+            i += 1
+            continue
+
+        for phoneme in MULTI_CHAR_PHONEMES:
+            if ipa.startswith(phoneme, i):
+                out.append((phoneme, class_))
+                i += len(phoneme)
+                break
+        else:
+            out.append((char, class_))
+            i += 1
+
+    return out
+
+
+@dataclasses.dataclass
+class Syllable:
+    onset: list[str]
+    nucleus: list[str]
+    coda: list[str]
+    stressed: bool = False
+
+    @property
+    def rhyme(self) -> str:
+        return "".join(self.nucleus + self.coda)
+
+    def __str__(self):
+        return ("ˈ" if self.stressed else "") + "".join(self.onset + self.nucleus + self.coda)
+
+
+def syllabify(ipa: str) -> list[Syllable]:
+    tokens = tokenize(ipa)
+
+    # nuclei are runs of vowels; stress marks and boundaries start the next syllable
+    syllables: list[Syllable] = []
+    consonants: list[str] = []
+    stress_next = False
+    forced_break = False
+
+    for phoneme, class_ in tokens:
+        if class_ == STRESS:
+            stress_next = True
+            forced_break = True
+        elif class_ == BOUNDARY:
+            forced_break = True
+        elif class_ == CONSONANT:
+            consonants.append(phoneme)
+        elif syllables and not consonants and not forced_break and not stress_next:
+            syllables[-1].nucleus.append(phoneme)
+        else:
+            if syllables and not forced_break:
+                # give the next syllable the longest allowed onset, the rest closes the previous one
+                onset_size = min(len(consonants), 1)
+                if len(consonants) >= 2 and "".join(consonants[-2:]) in ONSETS:
+                    onset_size = 2
+                split = len(consonants) - onset_size
+                syllables[-1].coda += consonants[:split]
+                consonants = consonants[split:]
+
+            syllables.append(Syllable(consonants, [phoneme], [], stress_next))
+            consonants = []
+            stress_next = forced_break = False
+
+    if syllables:
+        syllables[-1].coda += consonants
+    elif consonants:
+        syllables.append(Syllable([], [], consonants))
+
+    # German default: the first syllable is stressed
+    if syllables and not any(syllable.stressed for syllable in syllables):
+        syllables[0].stressed = True
+
+    return syllables
+
+
+def strip_length(phonemes: str) -> str:
+    return phonemes.replace("ː", "").replace("ˑ", "")
+
+
+def rhyme_key(syllables: list[Syllable]) -> str:
+    """Everything from the nucleus of the last stressed syllable on, "laufen" and "kaufen" share it."""
+    for i in range(len(syllables) - 1, -1, -1):
+        if syllables[i].stressed:
+            return strip_length(syllables[i].rhyme + "".join(str(syllable) for syllable in syllables[i + 1:]))
+    return ""
+
+
+def final_syllable_key(syllables: list[Syllable]) -> str:
+    """Nucleus and coda of the last syllable, a weaker rhyme."""
+    return strip_length(syllables[-1].rhyme) if syllables else ""
+
+
+def homophone_key(syllables: list[Syllable]) -> str:
+    phonemes = [phoneme for syllable in syllables for phoneme in syllable.onset + syllable.nucleus + syllable.coda]
+    return "".join(SIMILAR.get(strip_length(phoneme), strip_length(phoneme)) for phoneme in phonemes)
+
+
+class PhoneticIndex:
+    """key (e.g. Word.get_data_key()) -> syllables, and the reverse lookups by rhyme, final syllable and sound."""
+
+    def __init__(self):
+        self.syllables: dict[str, list[Syllable]] = {}
+
+        self._by_rhyme: dict[str, set[str]] = collections.defaultdict(set)
+        self._by_final_syllable: dict[str, set[str]] = collections.defaultdict(set)
+        self._by_sound: dict[str, set[str]] = collections.defaultdict(set)
+
+    @classmethod
+    def build(cls, entries: Iterable[tuple[str, str]]) -> "PhoneticIndex":
+        """entries: (key, ipa)"""
+        out = cls()
+        for key, ipa in entries:
+            out.add(key, ipa)
+        return out
+
+    def _keys(self, syllables: list[Syllable]):
+        return ((self._by_rhyme, rhyme_key(syllables)),
+                (self._by_final_syllable, final_syllable_key(syllables)),
+                (self._by_sound, homophone_key(syllables)))
+
+    def add(self, key: str, ipa: str):
+        self.remove(key)
+
+        syllables = self.syllables[key] = syllabify(ipa)
+        for table, value in self._keys(syllables):
+            if value:
+                table[value].add(key)
+
+    def remove(self, key: str):
+        if (syllables := self.syllables.pop(key, None)) is None:
+            return
+
+        for table, value in self._keys(syllables):
+            table[value].discard(key)
+            if not table[value]:
+                del table[value]
+
+    # the lookups return the index's own sets without copying them, they must not be modified
+
+    def rhymes(self, ipa: str) -> tuple[set[str], set[str]]:
+        """(keys sharing the whole rhyme, keys sharing the last syllable, which includes the former)"""
+        syllables = syllabify(ipa)
+        return (self._by_rhyme.get(rhyme_key(syllables), EMPTY),
+                self._by_final_syllable.get(final_syllable_key(syllables), EMPTY))
+
+    def near_homophones(self, ipa: str) -> set[str]:
+        return self._by_sound.get(homophone_key(syllabify(ipa)), EMPTY)
+
+    def __len__(self):
+        return len(self.syllables)
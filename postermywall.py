@@ -1,13 +1,21 @@
 import asyncio
+import base64
+import collections
+import contextlib
+import dataclasses
+import functools
 import io
+import os
 import time
-from typing import Literal
+import weakref
+from typing import Literal, Union
 
 import context_logger
 import discord
 import httpx
 import msgpack
 import selenium.common.exceptions
+from PIL import Image
 from selenium.webdriver import ActionChains
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.common.by import By
@@ -15,11 +23,10 @@ from selenium.webdriver.common.keys import Keys
 
 import cachelib
 import belissibot_framework
+import fabric_render
 import seleniumutil
 from context_logger import Logger, get_current_logger, log, log_decorator
 
-seleniumutil.prepare()
-
 size_options = ["all", "poster", "a1", "a2", "a3", "a4", "album-cover", "banner-2-6", "banner-2-8", "banner-4-6",
                 "business-card", "desktop-wallpaper", "desktop-wallpaper-inverted", "etsy-banner", "facebook-ad",
                 "facebook-cover", "facebook-cover-video", "facebook-shared-image", "flyer-letter", "google-cover",
@@ -32,6 +39,81 @@ size_options = ["all", "poster", "a1", "a2", "a3", "a4", "album-cover", "banner-
 
 client = httpx.AsyncClient()
 
+# previews and objects change when a template is edited upstream, renders are only as good as the objects
+cachelib.register_namespace("preview", ttl=24 * 60 * 60, stale_ttl=7 * 24 * 60 * 60, scoped=True)
+cachelib.register_namespace("objects", ttl=7 * 24 * 60 * 60, stale_ttl=30 * 24 * 60 * 60, scoped=True)
+cachelib.register_namespace("modify", ttl=30 * 24 * 60 * 60, scoped=True)
+# images of templates, for fabric_render
+cachelib.register_namespace("asset", ttl=7 * 24 * 60 * 60, stale_ttl=30 * 24 * 60 * 60)
+
+# pillow draws renders with fabric_render from the cached objects where it can, the browser does the rest
+RENDER_ENGINES = ("browser", "pillow")
+RENDER_ENGINE = os.environ.get("BELISSIBOT_POSTERMYWALL_ENGINE", "browser")
+
+# seconds, how long prepare waits for each phase before giving up
+FABRIC_TIMEOUT = 30
+RENDER_TIMEOUT = 10
+FONTS_TIMEOUT = 10
+POLL_INTERVAL = 0.1
+
+# wraps renderAll of all fabric canvases: the canvas that renders is kept as window.hopefullyklass and every finished
+# render is counted in window.belissibotRenders
+RENDER_HOOK = """
+if (fabric.Canvas.prototype._renderAll === undefined) {
+    window.belissibotRenders = 0;
+    fabric.Canvas.prototype._renderAll = fabric.Canvas.prototype.renderAll;
+    fabric.Canvas.prototype.renderAll = function () {
+        window.hopefullyklass = this;
+        const out = this._renderAll.apply(this, arguments);
+        window.belissibotRenders++;
+        return out;
+    };
+}
+"""
+
+# the canvas as a png data url, multiplier times the size of the design (not of the zoomed canvas on the page) or
+# scaled to the given width or height
+EXPORT_SCRIPT = """
+const [multiplier, width, height] = arguments;
+const canvas = window.hopefullyklass;
+const zoom = canvas.getZoom();
+let scale = multiplier;
+if (width) {
+    scale = width / (canvas.getWidth() / zoom);
+} else if (height) {
+    scale = height / (canvas.getHeight() / zoom);
+}
+return canvas.toDataURL({format: "png", multiplier: scale / zoom});
+"""
+
+# sets the texts of all [path, text] modifications at once, returns the [path, text] that undo them
+SET_TEXTS_SCRIPT = """
+const [modifications] = arguments;
+const undo = [];
+for (const [path, text] of modifications) {
+    let object = window.hopefullyklass;
+    for (const i of path) {
+        object = object._objects && object._objects[i];
+        if (!object) {
+            throw new Error("No object at " + JSON.stringify(path));
+        }
+    }
+    undo.unshift([path, object.text]);
+    object.setText(text);
+}
+return undo;
+"""
+
+# puts the canvas back to the objects it had when the tab was prepared
+RESET_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const canvas = window.hopefullyklass;
+canvas.loadFromJSON(window.belissibotOriginal, () => {
+    canvas.renderAll();
+    done(true);
+});
+"""
+
 
 @log_decorator("zoom out")
 def zoom_out(webdriver: WebDriver):
@@ -51,54 +133,49 @@ def zoom_in(webdriver: WebDriver):
         ActionChains(webdriver).key_down(Keys.CONTROL).send_keys('+').key_up(Keys.CONTROL).perform()
 
 
-@log_decorator("Invoking renderAll js method")
-def render_update(webdriver: WebDriver):
-    zoom_out(webdriver)
-
-    with log("Sleeping 1s"):
-        time.sleep(1)
-
-    zoom_in(webdriver)
+async def wait_until(webdriver: WebDriver, script: str, timeout: float, description: str) -> float:
+    """Polls script until it returns something truthy, returns the seconds that took."""
+    started = time.perf_counter()
+    while not webdriver.execute_script(script):
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError(f"Gave up waiting for {description} after {timeout}s")
+        await asyncio.sleep(POLL_INTERVAL)
 
+    return time.perf_counter() - started
 
-def zoom(webdriver: WebDriver, target: float = 100) -> int:
-    el = webdriver.find_element(By.XPATH, '// *[ @ id = "poster-nav-view"] / div')
 
-    d = target - int(el.get_attribute('innerHTML')[:-1])
+@log_decorator("Invoking renderAll js method")
+async def render_update(webdriver: WebDriver):
+    # renderAll is synchronous, once the hook has caught the canvas it can just be called
+    if webdriver.execute_script("if (window.hopefullyklass) {window.hopefullyklass.renderAll(); return true;}"):
+        return
 
-    while 1:
-        current = int(el.get_attribute('innerHTML')[:-1])
-        dnew = target - current
-        if -d < dnew - d:
-            return current
+    # until then, make the page render by itself
+    renders = webdriver.execute_script("return window.belissibotRenders;")
+    zoom_out(webdriver)
+    zoom_in(webdriver)
 
-        if dnew < 0:
-            zoom_out(webdriver)
-        elif dnew > 0:
-            zoom_in(webdriver)
-        else:
-            return current
+    took = await wait_until(webdriver, f"return window.hopefullyklass && window.belissibotRenders > {renders};",
+                            RENDER_TIMEOUT, "the canvas to render")
+    log(f"rendered after {took:.2f}s ✅")
 
 
 @log_decorator(lambda args: f"Preparing website {args['url']}")
 async def prepare(webdriver: WebDriver, url: str):
-    log("Resetting zoom")
-    zoom(webdriver, 100)
+    # phase -> seconds
+    timings = {}
+    started = time.perf_counter()
 
     with log("Getting website"):
         webdriver.get(url)
+    timings["website"] = time.perf_counter() - started
 
-    set_up = """
-    a = function() {
-        window.hopefullyklass = this;
-        this._renderAll();
-    }
-    fabric.Canvas.prototype._renderAll = fabric.Canvas.prototype.renderAll
-    fabric.Canvas.prototype.renderAll = a
-    """
+    with log("Waiting for fabric"):
+        timings["fabric"] = await wait_until(webdriver, "return !!(window.fabric && fabric.Canvas);",
+                                             FABRIC_TIMEOUT, "fabric to load")
 
-    log("Waiting")
-    await asyncio.sleep(5)
+    with log("Hooking renderAll"):
+        webdriver.execute_script(RENDER_HOOK)
 
     with log("Clicking on the cookie-accept banner"):
         try:
@@ -115,35 +192,163 @@ async def prepare(webdriver: WebDriver, url: str):
         except Exception as e:
             log(f"not a video 😐 {e.args[0]}")
 
-    with log("Running first script"):
-        webdriver.execute_script(set_up)
+    phase_started = time.perf_counter()
+    await render_update(webdriver)
+    timings["canvas"] = time.perf_counter() - phase_started
+
+    # the texts only ask for their fonts when they are drawn, so they get drawn again once the fonts are there
+    with log("Waiting for fonts"):
+        timings["fonts"] = await wait_until(webdriver, "return document.fonts.status === 'loaded';",
+                                            FONTS_TIMEOUT, "the fonts to load")
+    await render_update(webdriver)
 
-    render_update(webdriver)
+    log(f"Ready after {time.perf_counter() - started:.2f}s ✅ "
+        f"({', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in timings.items())})")
 
-    maxtries = 20
-    with log("Checking if method worked"):
-        for try_ in range(maxtries):
-            with log(f"Try: {try_}/{maxtries}"):
-                try:
-                    webdriver.execute_script("return window.hopefullyklass.toJSON();")
-                    log("success ✅")
-                    return
-                except selenium.common.exceptions.JavascriptException as e:
-                    log(f"didn't work 😢 {e.args[0]}")
 
-                    render_update(webdriver)
+@dataclasses.dataclass
+class EditorTab:
+    handle: str
+    # true once a job changed the canvas, the next one resets it first
+    dirty: bool = False
+    # js heap of the tab after its last job, in bytes
+    memory: Union[int, None] = None
+    # cachelib generation of the template's objects when the tab was prepared, see editor_tab
+    generation: int = 0
 
-                    print("Waiting")
-                    await asyncio.sleep(2)
+
+# template id -> prepared editor tab of each browser, most recently used last, at most seleniumutil.WARM_TABS
+_tabs: weakref.WeakKeyDictionary[WebDriver, collections.OrderedDict[str, EditorTab]] = weakref.WeakKeyDictionary()
+# the tab other jobs (e.g. google_dictionary) use, every editor job switches back to it
+_main_handles: weakref.WeakKeyDictionary[WebDriver, str] = weakref.WeakKeyDictionary()
+
+tab_stats = collections.Counter()
+
+
+def get_tab_stats() -> dict:
+    """Editor tabs of the browsers in this process, so only of thread workers."""
+    tabs = [tab for browser_tabs in _tabs.values() for tab in browser_tabs.values()]
+    requests = tab_stats["hits"] + tab_stats["misses"]
+    return {"tabs": len(tabs),
+            "hit_rate": tab_stats["hits"] / requests if requests else None,
+            "memory": sum(tab.memory for tab in tabs if tab.memory is not None),
+            **tab_stats}
+
+
+def _close_tab(webdriver: WebDriver, tab: EditorTab):
+    try:
+        webdriver.switch_to.window(tab.handle)
+        webdriver.close()
+    except selenium.common.exceptions.WebDriverException as e:
+        log(f"already gone 😐 {e.args[0] if e.args else e!r}")
+
+
+def _is_ready(webdriver: WebDriver, tab: EditorTab) -> bool:
+    try:
+        webdriver.switch_to.window(tab.handle)
+        return webdriver.execute_script("return !!(window.hopefullyklass && window.belissibotOriginal);")
+    except selenium.common.exceptions.WebDriverException:
+        return False
+
+
+@contextlib.asynccontextmanager
+async def editor_tab(webdriver: WebDriver, template_id: str, url: str, generation: int = 0, fresh: bool = False):
+    """
+    Switches to the browser's prepared tab of the template, with the template's original objects, and back to the main
+    tab afterwards. The tab is prepared first if the browser has none, if it was prepared for another generation of
+    the objects (the template was invalidated since) or if fresh is true.
+    """
+    tabs = _tabs.setdefault(webdriver, collections.OrderedDict())
+    main_handle = _main_handles.setdefault(webdriver, webdriver.current_window_handle)
+
+    try:
+        tab = tabs.get(template_id)
+        if tab is not None and tab.generation == generation and not fresh and _is_ready(webdriver, tab):
+            tab_stats["hits"] += 1
+            log("Reusing the prepared tab ♻️")
+
+            if tab.dirty:
+                with log("Resetting the objects"):
+                    webdriver.execute_async_script(RESET_SCRIPT)
+                    tab.dirty = False
+                    tab_stats["resets"] += 1
         else:
-            raise Exception("Could not get the Canvas object. Tried 20 times. Aborting.") from e
+            tab_stats["misses"] += 1
+            if tab is not None:
+                with log("Closing the outdated or broken tab"):
+                    _close_tab(webdriver, tabs.pop(template_id))
+
+            while len(tabs) >= seleniumutil.WARM_TABS:
+                evicted_id, evicted = tabs.popitem(last=False)
+                with log(f"Closing the tab of {evicted_id}"):
+                    _close_tab(webdriver, evicted)
+                    tab_stats["evictions"] += 1
 
+            # closing tabs leaves no current window, which opening one needs
+            webdriver.switch_to.window(main_handle)
+            with log("Opening a tab"):
+                webdriver.switch_to.new_window("tab")
+                tab = EditorTab(webdriver.current_window_handle, generation=generation)
+            try:
+                await prepare(webdriver, url)
+                webdriver.execute_script("window.belissibotOriginal = window.hopefullyklass.toJSON();")
+            except BaseException:
+                _close_tab(webdriver, tab)
+                raise
+            tabs[template_id] = tab
 
-@log_decorator("Screenshotting")
-def screenshot(webdriver: WebDriver) -> bytes:
-    seleniumutil.zoom(webdriver, 1)
-    # noinspection PyTypeChecker
-    return webdriver.find_element(By.ID, "whiteboard").screenshot_as_png
+        tabs.move_to_end(template_id)
+        yield tab
+
+        tab.memory = webdriver.execute_script("return performance.memory && performance.memory.usedJSHeapSize;")
+    finally:
+        webdriver.switch_to.window(main_handle)
+
+
+@log_decorator("Exporting the canvas")
+def export(webdriver: WebDriver, multiplier: float = 1, width: int = None, height: int = None) -> bytes:
+    """PNG of the hooked canvas, straight from fabric, see EXPORT_SCRIPT."""
+    data_url = webdriver.execute_script(EXPORT_SCRIPT, multiplier, width, height)
+    return base64.b64decode(data_url.split(",", 1)[1])
+
+
+def fit(data: bytes, width: int = None, height: int = None) -> bytes:
+    """Resizes the PNG to the given width and height, e.g. when fabric rounded them, if it doesn't have them yet."""
+    image = Image.open(io.BytesIO(data))
+    size = (width or image.width, height or image.height)
+    if image.size == size:
+        return data
+
+    out = io.BytesIO()
+    image.resize(size, Image.LANCZOS).save(out, format="png")
+    return out.getvalue()
+
+
+def fit_all(images: list[bytes], width: int = None, height: int = None) -> list[bytes]:
+    return [fit(data, width, height) for data in images]
+
+
+def get_objects(object_: dict, path: list[int] = None) -> list[tuple[list[int], dict]]:
+    path = [] if path is None else path
+
+    if "objects" not in object_:
+        return [(path, object_)]
+
+    out = []
+    for i, object_ in enumerate(object_["objects"]):
+        out += get_objects(object_, path + [i])
+
+    return out
+
+
+async def get_asset(url: str) -> bytes:
+    async def download():
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.content
+
+    # a disk hit is a memoryview, which can't be pickled for run_cpu's worker processes
+    return bytes(await cachelib.cached(("asset", url), download))
 
 
 def format_obj(obj: dict):
@@ -208,46 +413,53 @@ class Template:
 
     async def get_dc_file(self, message: discord.Message):
         if self.type_ == "image":
-            if data := cachelib.get(("preview", self.id_)):
-                ...
-            else:
-                data = (await client.get(self.preview_url)).content
-                cachelib.save(data, ("preview", self.id_))
+            async def download():
+                return (await client.get(self.preview_url)).content
+
+            data = await cachelib.cached(("preview", self.id_), download)
 
             return discord.File(fp=io.BytesIO(data),
                                 filename=f"{self.id_}.{'jpg' if self.type_ == 'image' else 'mp4'}")
         else:
             return await self.get_dc_modify_file([])
 
-    async def get_objects(self, webdriver: WebDriver) -> list[dict]:
-        def _get_objects(object_: dict, path: list[int] = None):
-            path = [] if path is None else path
-
-            if "objects" not in object_:
-                return [(path, object_)]
-
-            out = []
-            for i, object_ in enumerate(object_["objects"]):
-                out += _get_objects(object_, path + [i])
+    def invalidate_cache(self):
+        """Forgets the preview, objects and all renders of this template, e.g. after it changed upstream."""
+        for namespace in ("preview", "objects", "modify"):
+            cachelib.invalidate(namespace, self.id_)
+
+    def _get_generation(self) -> int:
+        # the browser's tabs keep the objects they were prepared with, invalidate_cache makes them outdated
+        return cachelib.get_generation("objects", self.id_)
+
+    async def _get_objects_data(self, webdriver: WebDriver, generation: int = 0) -> bytes:
+        # only runs when the cached objects are missing or old, so the tab's snapshot is too
+        async with editor_tab(webdriver, self.id_, self.customize_url, generation, fresh=True):
+            with log("Getting canvas object"):
+                # with the design size, for fabric_render
+                object_json = webdriver.execute_script(
+                    "const canvas = window.hopefullyklass;"
+                    "return {...window.belissibotOriginal, width: canvas.getWidth() / canvas.getZoom(), "
+                    "height: canvas.getHeight() / canvas.getZoom()};")
 
-            return out
-
-        if objts := cachelib.get(("objects", self.id_)):
-            return _get_objects(msgpack.loads(objts))
-
-        await prepare(webdriver, self.customize_url)
+        log("Finished!")
 
-        with log("Getting canvas object"):
-            object_json = webdriver.execute_script("return window.hopefullyklass.toJSON();")
+        return msgpack.dumps(object_json)
 
-        log("Finished!")
+    async def get_canvas_data(self) -> dict:
+        """The fabric JSON of the template's canvas."""
+        data = await seleniumutil.run_cached("objects", ("objects", self.id_),
+                                             functools.partial(seleniumutil.run_coroutine, self._get_objects_data,
+                                                               generation=self._get_generation()),
+                                             affinity=("postermywall", self.id_))
 
-        cachelib.save(msgpack.dumps(object_json), ("objects", self.id_))
+        return msgpack.loads(data)
 
-        return _get_objects(object_json)
+    async def get_objects(self) -> list[tuple[list[int], dict]]:
+        return get_objects(await self.get_canvas_data())
 
     async def get_dc_attrs_embed(self) -> discord.Embed:
-        objects = await seleniumutil.run_function(lambda webdriver: asyncio.run(self.get_objects(webdriver)))
+        objects = await self.get_objects()
         out = discord.Embed(title=f"Attributes of `{self.id_}` ({self.name})",
                             description="\n".join([format_obj(obj) for obj in objects
                                                    if "text" in obj[1]]))
@@ -261,33 +473,134 @@ class Template:
         return out
 
     @log_decorator("Modifying")
-    async def modify(self, webdriver: WebDriver, modifications: list[tuple[list[int], str]]):
-        await prepare(webdriver, self.customize_url)
-
+    async def modify(self, webdriver: WebDriver, tab: EditorTab,
+                     modifications: list[tuple[list[int], str]]) -> list[tuple[list[int], str]]:
+        """Applies all modifications in one script and renders, returns the modifications that undo them."""
+        tab.dirty = True
         with log("Modifying"):
-            for path, mod in modifications:
-                with log(f"{path!r}: {mod!r}"):
-                    modstr = f"window.hopefullyklass{''.join([f'._objects[{i}]' for i in path])}.setText({mod!r})"
-                    log(modstr)
-                    webdriver.execute_script(modstr)
+            log(f"{modifications!r}")
+            undo = webdriver.execute_script(SET_TEXTS_SCRIPT, [[list(path), text] for path, text in modifications])
+
+        # like in prepare, drawing the new texts asks for their fonts, then they are drawn again with them
+        await render_update(webdriver)
+        await wait_until(webdriver, "return document.fonts.status === 'loaded';", FONTS_TIMEOUT, "the fonts to load")
+        await render_update(webdriver)
+        return undo
+
+    async def _get_variants_data(self, webdriver: WebDriver, variants: list[list[tuple[list[int], str]]],
+                                 multiplier: float = 1, width: int = None, height: int = None,
+                                 generation: int = 0) -> list[bytes]:
+        out = []
+        async with editor_tab(webdriver, self.id_, self.customize_url, generation) as tab:
+            for i, modifications in enumerate(variants):
+                with log(f"Variant {i + 1}/{len(variants)}"):
+                    undo = await self.modify(webdriver, tab, modifications)
+                    out.append(export(webdriver, multiplier, width, height))
+
+                    # only the changed texts are set back, cheaper than resetting all objects
+                    webdriver.execute_script(SET_TEXTS_SCRIPT, undo)
+                    tab.dirty = False
 
-        render_update(webdriver)
+        return out
 
-    async def _get_modify_data(self, webdriver: WebDriver, modifications: list[tuple[list[int], str]]):
-        await self.modify(webdriver, modifications)
+    async def _get_modify_data(self, webdriver: WebDriver, modifications: list[tuple[list[int], str]],
+                               multiplier: float = 1, width: int = None, height: int = None,
+                               generation: int = 0) -> bytes:
+        return (await self._get_variants_data(webdriver, [modifications], multiplier, width, height, generation))[0]
+
+    def _get_modify_hash_obj(self, modifications: list[tuple[list[int], str]], multiplier: float = 1,
+                             width: int = None, height: int = None, engine: str = "browser"):
+        if engine == "browser":
+            return "modify", self.id_, modifications, multiplier, width, height
+        return "modify", self.id_, modifications, multiplier, width, height, engine
+
+    async def _get_offline_modify_data(self, modifications: list[tuple[list[int], str]], multiplier: float = 1,
+                                       width: int = None, height: int = None) -> Union[bytes, None]:
+        """The render drawn by fabric_render, None if it can't draw it and the browser has to."""
+        # only worth it once the objects are there, getting them takes the browser
+        if (entry := await cachelib.alookup(("objects", self.id_))) is None:
+            log("The objects aren't cached yet, rendering in the browser")
+            return None
+
+        async def render():
+            data = fabric_render.set_texts(msgpack.loads(entry[0]), modifications)
+            sources = sorted(fabric_render.get_image_sources(data))
+            images = dict(zip(sources, await asyncio.gather(*[get_asset(source) for source in sources])))
+
+            with log("Drawing the render without the browser"):
+                out = await seleniumutil.run_cpu(fabric_render.render, data, images, multiplier, width, height)
+            return await seleniumutil.run_cpu(fit, out, width, height)
 
-        return screenshot(webdriver)
+        try:
+            return bytes(await cachelib.cached(
+                self._get_modify_hash_obj(modifications, multiplier, width, height, "pillow"), render))
+        except (fabric_render.UnsupportedObject, httpx.HTTPError) as e:
+            log(f"Falling back to the browser 😐 {e}")
+            return None
+
+    async def get_dc_modify_file(self, modifications: list[tuple[list[int], str]], multiplier: float = 1,
+                                 width: int = None, height: int = None, engine: str = None) -> discord.File:
+        """
+        The template with the modifications, multiplier times its design size or exactly width and/or height pixels
+        (the other side keeps the aspect ratio). engine is one of RENDER_ENGINES, RENDER_ENGINE by default.
+        """
+        engine = RENDER_ENGINE if engine is None else engine
+        if engine not in RENDER_ENGINES:
+            raise belissibot_framework.BotError(f"Unknown render engine {engine!r}, use one of {RENDER_ENGINES}.")
+
+        if engine == "pillow" and (data := await self._get_offline_modify_data(modifications, multiplier, width,
+                                                                                height)) is not None:
+            return discord.File(fp=io.BytesIO(data), filename="image.png")
+
+        data = await seleniumutil.run_cached(
+            "modify", self._get_modify_hash_obj(modifications, multiplier, width, height),
+            functools.partial(seleniumutil.run_coroutine, self._get_modify_data, modifications=modifications,
+                              multiplier=multiplier, width=width, height=height, generation=self._get_generation()),
+            size=None, scale=None, postprocess=functools.partial(fit, width=width, height=height),
+            affinity=("postermywall", self.id_))
 
-    async def get_dc_modify_file(self, modifications: list[tuple[list[int], str]]) -> discord.File:
-        if data := cachelib.get(("modify", self.id_, modifications)):
-            ...
-        else:
-            data = await seleniumutil.run_function(
-                lambda webdriver: asyncio.run(self._get_modify_data(webdriver, modifications)), scale=4)
+        return discord.File(fp=io.BytesIO(data), filename="image.png")
 
-            cachelib.save(data, ("modify", self.id_, modifications))
+    async def get_variants(self, variants: list[list[tuple[list[int], str]]], multiplier: float = 1,
+                           width: int = None, height: int = None, engine: str = None) -> list[bytes]:
+        """
+        One image per list of modifications, like get_dc_modify_file. Those that aren't cached are all rendered in one
+        browser job from one loaded editor.
+        """
+        engine = RENDER_ENGINE if engine is None else engine
+        if engine not in RENDER_ENGINES:
+            raise belissibot_framework.BotError(f"Unknown render engine {engine!r}, use one of {RENDER_ENGINES}.")
+
+        hash_objs = [self._get_modify_hash_obj(modifications, multiplier, width, height) for modifications in variants]
+
+        out: list[Union[bytes, None]] = []
+        for modifications, hash_obj in zip(variants, hash_objs):
+            if engine == "pillow" and (data := await self._get_offline_modify_data(modifications, multiplier, width,
+                                                                                    height)) is not None:
+                out.append(data)
+                continue
+
+            entry = await cachelib.alookup(hash_obj)
+            out.append(None if entry is None else bytes(entry[0]))
+
+        if missing := [i for i, data in enumerate(out) if data is None]:
+            log(f"Rendering {len(missing)} of {len(variants)} variants")
+            rendered = await seleniumutil.run_function(
+                functools.partial(seleniumutil.run_coroutine, self._get_variants_data,
+                                  variants=[variants[i] for i in missing], multiplier=multiplier, width=width,
+                                  height=height, generation=self._get_generation()),
+                size=None, scale=None, postprocess=functools.partial(fit_all, width=width, height=height),
+                affinity=("postermywall", self.id_))
+
+            for i, data in zip(missing, rendered):
+                out[i] = data
+                await cachelib.asave(data, hash_objs[i])
 
-        return discord.File(fp=io.BytesIO(data), filename="image.png")
+        return out
+
+    async def get_dc_variant_files(self, variants: list[list[tuple[list[int], str]]]) -> list[discord.File]:
+        return [discord.File(fp=io.BytesIO(data), filename=f"image_{i}.png")
+                for i, data in enumerate(await self.get_variants(variants))]
 
 
 async def search(keyword: str, type_: Literal["all", "image", "video"] = "all", size: str = "all") -> list[Template]:
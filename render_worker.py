@@ -0,0 +1,104 @@
+"""
+Child process of seleniumutil.ProcessWorker, started as a script (not through multiprocessing) so the bot's main
+module isn't imported again:
+
+    python render_worker.py <socket fd> browser|cpu
+
+Receives pickled jobs over the socket and calls them with its own WebDriver (browser) or without arguments (cpu).
+bytes in results, also inside tuples and lists (e.g. a png with its offset), are handed back in shared memory blocks,
+everything else pickled.
+"""
+import pickle
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+
+# sent instead of a pickled job to shut the worker down
+STOP = b"stop"
+
+
+def to_shared_memory(data: bytes) -> tuple[str, int]:
+    shared_memory = SharedMemory(create=True, size=len(data))
+    shared_memory.buf[:len(data)] = data
+
+    # the receiving process unlinks it, this one's resource tracker must not clean it up when the worker exits
+    resource_tracker.unregister(shared_memory._name, "shared_memory")
+    shared_memory.close()
+    return shared_memory.name, len(data)
+
+
+def from_shared_memory(name: str, size: int) -> bytes:
+    shared_memory = SharedMemory(name=name)
+    try:
+        return bytes(shared_memory.buf[:size])
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+def pack(result) -> tuple:
+    if isinstance(result, (bytes, bytearray)) and result:
+        return "shm", *to_shared_memory(result)
+    # not subclasses, e.g. named tuples can't be built from a list
+    if type(result) in (tuple, list):
+        return type(result).__name__, [pack(item) for item in result]
+    return "value", result
+
+
+def unpack(packed: tuple):
+    status, *value = packed
+    if status == "shm":
+        return from_shared_memory(*value)
+    if status == "tuple":
+        return tuple(unpack(item) for item in value[0])
+    if status == "list":
+        return [unpack(item) for item in value[0]]
+    return value[0]
+
+
+def send_result(connection: Connection, result):
+    connection.send(pack(result))
+
+
+def send_exception(connection: Connection, exception: BaseException):
+    try:
+        connection.send(("error", exception))
+    except Exception:
+        # not picklable
+        connection.send(("error", RuntimeError(f"{type(exception).__name__}: {exception}")))
+
+
+def main():
+    connection = Connection(int(sys.argv[1]))
+    with_browser = sys.argv[2] == "browser"
+
+    webdriver = None
+    try:
+        if with_browser:
+            import seleniumutil
+            webdriver = seleniumutil.WebDriver(options=seleniumutil.chrome_options)
+    except BaseException as e:
+        send_exception(connection, e)
+        return
+    connection.send(("ready", None))
+
+    try:
+        while (data := connection.recv_bytes()) != STOP:
+            try:
+                job = pickle.loads(data)
+                result = job(webdriver) if with_browser else job()
+            except BaseException as e:
+                send_exception(connection, e)
+            else:
+                send_result(connection, result)
+    except EOFError:
+        # the bot is gone
+        pass
+    finally:
+        if webdriver is not None:
+            webdriver.quit()
+
+
+if __name__ == '__main__':
+    main()
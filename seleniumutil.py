@@ -1,10 +1,28 @@
-from asyncio import Event, Semaphore
-from multiprocessing.pool import ThreadPool
-from typing import Callable, Union
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import dataclasses
+import enum
+import functools
+import itertools
+import multiprocessing.connection
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Coroutine, Hashable, Union
 
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.webdriver import WebDriver
 
+import cachelib
+import render_worker
 from context_logger import Logger, log, log_decorator, loggerstack_contextvar, nlist_contextvar, get_current_nlist, \
     get_current_logger
 
@@ -12,47 +30,511 @@ chrome_options = Options()
 chrome_options.add_argument("--headless")
 
 
-class WebBrowserQueue:
-    def __init__(self, num_browsers=2):
-        self.browsers: list[list[(WebDriver, bool)]] = []
+def set_logger(logger: Logger, nlist: list[int]):
+    loggerstack_contextvar.set([logger])
+    nlist_contextvar.set(nlist[:])
+
+
+def _set_future_result(future: asyncio.Future, result, exception: Union[BaseException, None]):
+    if future.cancelled():
+        return
+
+    if exception is None:
+        future.set_result(result)
+    else:
+        future.set_exception(exception)
+
+
+# pool size, browsers are started on demand and stopped again (down to MIN_BROWSERS) after IDLE_TIMEOUT seconds
+# without a lease
+MIN_BROWSERS = 1
+MAX_BROWSERS = 5
+IDLE_TIMEOUT = 5 * 60
+IDLE_CHECK_INTERVAL = 30
+
+# a browser is replaced after this many leases or once it and its child processes use more memory than this
+MAX_USES = 200
+MAX_RSS = 1536 * 1024 ** 2
+HEALTH_CHECK_TIMEOUT = 10
+# pages a browser keeps open for jobs with an affinity, jobs with the same affinity are routed to the same browser
+WARM_TABS = 3
+
+WAIT_SAMPLES = 1000
+
+# run browsers and image work in render_worker.py child processes instead of threads of the bot
+PROCESS_WORKERS = os.environ.get("BELISSIBOT_PROCESS_WORKERS", "0") == "1"
+CPU_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+PROCESS_STOP_TIMEOUT = 30
+RENDER_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_worker.py")
+
+
+class Priority(enum.IntEnum):
+    # lower values are served first
+    INTERACTIVE = 0
+    BULK = 1
+
+
+# how long a job may wait for a browser if job_options() doesn't say otherwise, None to wait forever
+DEFAULT_TIMEOUTS = {Priority.INTERACTIVE: 2 * 60, Priority.BULK: None}
+
+
+@dataclasses.dataclass(frozen=True)
+class JobOptions:
+    priority: Priority = Priority.INTERACTIVE
+    # jobs of different owners (e.g. channel and user) take turns within a priority class
+    owner: Hashable = None
+    # time.monotonic() after which the job is dropped instead of waiting for a browser any longer
+    deadline: Union[float, None] = None
+
+
+_job_options: contextvars.ContextVar[JobOptions] = contextvars.ContextVar("job_options", default=JobOptions())
+
+
+@contextlib.contextmanager
+def job_options(priority: Priority = Priority.INTERACTIVE, owner: Hashable = None, timeout: float = None):
+    """Scheduling of all browser jobs started inside, timeout defaults to DEFAULT_TIMEOUTS[priority]."""
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUTS[priority]
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    token = _job_options.set(JobOptions(priority, owner, deadline))
+    try:
+        yield
+    finally:
+        _job_options.reset(token)
+
+
+class DeadlineExceeded(TimeoutError):
+    ...
+
 
-        with log(f"Creating browsers ({num_browsers})..."):
-            for i in range(num_browsers):
-                log(f"{i}")
-                driver = WebDriver(options=chrome_options)
-                self.browsers.append([driver, True])
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
 
-        self.semaphore = Semaphore(num_browsers)
 
-    @log_decorator("acquiring browser lock")
-    async def aquire(self) -> WebDriver:
-        await self.semaphore.acquire()
+def _process_tree(pid: int) -> list[int]:
+    out = [pid]
+    for pid_ in out:
+        try:
+            for task in os.listdir(f"/proc/{pid_}/task"):
+                with open(f"/proc/{pid_}/task/{task}/children") as f:
+                    out += map(int, f.read().split())
+        except OSError:
+            continue
+    return out
+
 
-        for i, (web_driver, is_free) in enumerate(self.browsers):
-            if is_free:
-                self.browsers[i][1] = False
-                break
+def get_rss(pid: int) -> Union[int, None]:
+    """Resident memory of a process and all its descendants in bytes, None where /proc isn't available."""
+    if not os.path.exists(f"/proc/{pid}"):
+        return None
+
+    total = 0
+    for pid_ in _process_tree(pid):
+        try:
+            with open(f"/proc/{pid_}/statm") as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+    return total
+
+
+class BrowserWorker:
+    """A WebDriver and the one thread that is allowed to touch it, jobs are handed over through a queue."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.webdriver: Union[WebDriver, None] = None
+        self.jobs: queue.Queue = queue.Queue()
+        # resolved with the worker once its browser is running
+        self.ready = concurrent.futures.Future()
+
+        self.uses = 0
+        self.last_used = time.monotonic()
+        # affinities of the last jobs, most recent last, at most WARM_TABS
+        self.affinities: collections.OrderedDict[Hashable, None] = collections.OrderedDict()
+
+        self.thread = threading.Thread(target=self._work, name=name, daemon=True)
+        self.thread.start()
+
+    def _start(self):
+        self.webdriver = WebDriver(options=chrome_options)
+
+    def _call(self, func: Callable[[WebDriver], object]):
+        return func(self.webdriver)
+
+    def _close(self):
+        self.webdriver.quit()
+
+    def _get_pid(self) -> Union[int, None]:
+        """The process at the root of the browser's process tree."""
+        if self.webdriver is None or self.webdriver.service.process is None:
+            return None
+        return self.webdriver.service.process.pid
+
+    def _work(self):
+        try:
+            self._start()
+        except BaseException as e:
+            self.ready.set_exception(e)
+            return
+        self.ready.set_result(self)
+
+        while (job := self.jobs.get()) is not None:
+            loop, future, func, logger, nlist = job
+            if future.cancelled():
+                continue
+
+            set_logger(logger, nlist)
+            result = exception = None
+            try:
+                result = self._call(func)
+            except BaseException as e:
+                exception = e
+
+            loop.call_soon_threadsafe(_set_future_result, future, result, exception)
+
+        try:
+            self._close()
+        except Exception:
+            self.kill()
+
+    def submit(self, func: Callable[[WebDriver], object]) -> asyncio.Future:
+        """Runs func(webdriver) on the worker thread with the caller's logger context."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        self.jobs.put((loop, future, func, get_current_logger(), get_current_nlist()))
+        return future
+
+    async def is_healthy(self) -> bool:
+        if not self.thread.is_alive():
+            return False
+
+        future = self.submit(ping)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), HEALTH_CHECK_TIMEOUT) == 1
+        except Exception:
+            return False
+
+    def get_rss(self) -> Union[int, None]:
+        return None if (pid := self._get_pid()) is None else get_rss(pid)
+
+    def stop(self):
+        """Quits the browser once the jobs before are done."""
+        self.jobs.put(None)
+
+    def kill(self):
+        """For browsers that don't react anymore, the worker thread is left to die with its next WebDriver call."""
+        if (root_pid := self._get_pid()) is None:
+            return
+
+        for pid in reversed(_process_tree(root_pid)):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+
+class ProcessWorker(BrowserWorker):
+    """
+    Runs the jobs in a render_worker.py child process, which owns the browser (with_browser) and does the image work
+    there, outside of the bot's GIL. Jobs have to be picklable, e.g. functools.partial of module level functions, and
+    their log lines end up on the child's stdout.
+    """
+
+    def __init__(self, name: str, with_browser: bool = True):
+        self.with_browser = with_browser
+        self.process: Union[subprocess.Popen, None] = None
+        self.connection: Union[multiprocessing.connection.Connection, None] = None
+
+        super().__init__(name)
+
+    def _start(self):
+        parent_socket, child_socket = socket.socketpair()
+        with child_socket:
+            self.process = subprocess.Popen([sys.executable, RENDER_WORKER, str(child_socket.fileno()),
+                                             "browser" if self.with_browser else "cpu"],
+                                            pass_fds=[child_socket.fileno()])
+        self.connection = multiprocessing.connection.Connection(parent_socket.detach())
+
+        status, value = self.connection.recv()
+        if status == "error":
+            raise value
+
+    def _call(self, func: Callable):
+        self.connection.send(func)
+
+        packed = self.connection.recv()
+        if packed[0] == "error":
+            raise packed[1]
+        return render_worker.unpack(packed)
+
+    def _close(self):
+        self.connection.send_bytes(render_worker.STOP)
+        self.process.wait(PROCESS_STOP_TIMEOUT)
+        self.connection.close()
+
+    def _get_pid(self) -> Union[int, None]:
+        return None if self.process is None else self.process.pid
+
+
+def ping(webdriver: WebDriver) -> int:
+    return webdriver.execute_script("return 1;")
+
+
+def run_coroutine(func: Callable[..., Coroutine], webdriver: WebDriver, **kwargs):
+    """Picklable job for coroutine functions: functools.partial(run_coroutine, func, **kwargs)."""
+    return asyncio.run(func(webdriver, **kwargs))
+
+
+class BrowserPool:
+    def __init__(self, min_size: int = MIN_BROWSERS, max_size: int = MAX_BROWSERS):
+        self.min_size = min_size
+        self.max_size = max_size
+
+        # most recently used last, so the oldest browsers are the ones that get idle
+        self.idle: list[BrowserWorker] = []
+        self.leased: set[BrowserWorker] = set()
+        # browsers that are running or starting
+        self.size = 0
+        # futures of acquire() calls waiting for a browser, resolved with one or with None to try again
+        # priority -> owner -> waiters, owners are moved to the end after each of their turns
+        self.waiters: dict[Priority, collections.OrderedDict[Hashable, collections.deque[asyncio.Future]]] = {
+            priority: collections.OrderedDict() for priority in Priority}
+
+        self.counters = collections.Counter()
+        self.wait_times: collections.deque[float] = collections.deque(maxlen=WAIT_SAMPLES)
+
+        self._reaper: Union[asyncio.Task, None] = None
+        self._names = itertools.count()
+
+    async def _launch(self) -> BrowserWorker:
+        self.size += 1
+        self.counters["launches"] += 1
+        with log(f"Starting a browser ({self.size}/{self.max_size})..."):
+            try:
+                worker_class = ProcessWorker if PROCESS_WORKERS else BrowserWorker
+                worker = worker_class(f"browser-{next(self._names)}")
+                ready = asyncio.wrap_future(worker.ready)
+            except BaseException:
+                self._launch_failed()
+                raise
+
+            try:
+                # shielded, cancelling ready would leave the starting browser running outside the pool
+                return await asyncio.shield(ready)
+            except asyncio.CancelledError:
+                log("Cancelled, the browser joins the pool once it is running")
+                ready.add_done_callback(self._adopt)
+                raise
+            except BaseException:
+                self._launch_failed()
+                raise
+
+    def _launch_failed(self):
+        self.size -= 1
+        self._hand_over(None)
+
+    def _adopt(self, ready: asyncio.Future):
+        """Done callback for browsers whose caller stopped waiting for them."""
+        if ready.cancelled() or ready.exception() is not None:
+            self._launch_failed()
         else:
-            raise Exception("Semaphore told lies!")
-        return web_driver
+            self._hand_over(ready.result())
+
+    def _discard(self, worker: BrowserWorker, reason: str, kill: bool = False):
+        log(f"Replacing {worker.name}: {reason}")
+        self.counters[f"recycled_{reason}"] += 1
+        self.size -= 1
+
+        if kill:
+            worker.kill()
+        worker.stop()
+
+    def _enqueue(self, options: JobOptions, waiter: asyncio.Future):
+        self.waiters[options.priority].setdefault(options.owner, collections.deque()).append(waiter)
+
+    def _dequeue(self, options: JobOptions, waiter: asyncio.Future):
+        owners = self.waiters[options.priority]
+        if waiter in (waiters := owners.get(options.owner, ())):
+            waiters.remove(waiter)
+            if not waiters:
+                del owners[options.owner]
+
+    def _next_waiter(self) -> Union[asyncio.Future, None]:
+        for priority in Priority:
+            owners = self.waiters[priority]
+            if not owners:
+                continue
+
+            owner, waiters = next(iter(owners.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                owners.move_to_end(owner)
+            else:
+                del owners[owner]
+            return waiter
+
+        return None
+
+    def _hand_over(self, worker: Union[BrowserWorker, None]):
+        while (waiter := self._next_waiter()) is not None:
+            if not waiter.done():
+                waiter.set_result(worker)
+                return
+
+        if worker is not None:
+            self.idle.append(worker)
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL)
+
+            now = time.monotonic()
+            for worker in list(self.idle):
+                if self.size <= self.min_size:
+                    break
+                if now - worker.last_used > IDLE_TIMEOUT:
+                    self.idle.remove(worker)
+                    self._discard(worker, "idle")
+
+    def _pop_idle(self, affinity: Hashable = None) -> BrowserWorker:
+        if affinity is not None:
+            for worker in reversed(self.idle):
+                if affinity in worker.affinities:
+                    self.counters["affinity_hits"] += 1
+                    self.idle.remove(worker)
+                    return worker
+            self.counters["affinity_misses"] += 1
+
+        return self.idle.pop()
+
+    async def _check(self, worker: BrowserWorker) -> bool:
+        """Whether the worker can be leased, unhealthy ones are discarded."""
+        try:
+            healthy = await worker.is_healthy()
+        except BaseException:
+            # cancelled while checking, the worker isn't leased yet and goes back to the pool
+            self._hand_over(worker)
+            raise
+
+        if not healthy:
+            self._discard(worker, "unhealthy", kill=True)
+        return healthy
+
+    async def _get(self, options: JobOptions, affinity: Hashable = None) -> BrowserWorker:
+        while True:
+            if self.idle:
+                if await self._check(worker := self._pop_idle(affinity)):
+                    return worker
+                continue
+
+            if self.size < self.max_size:
+                return await self._launch()
+
+            timeout = None if options.deadline is None else options.deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                self.counters["deadline_exceeded"] += 1
+                raise DeadlineExceeded("No browser became free before the job's deadline.")
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._enqueue(options, waiter)
+            try:
+                worker = await asyncio.wait_for(waiter, timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+                # dropped before touching a browser
+                self._dequeue(options, waiter)
+                if waiter.done() and not waiter.cancelled() and waiter.result() is not None:
+                    self._hand_over(waiter.result())
+
+                if isinstance(e, asyncio.TimeoutError):
+                    self.counters["deadline_exceeded"] += 1
+                    raise DeadlineExceeded("No browser became free before the job's deadline.") from e
+                self.counters["cancelled_queued"] += 1
+                raise
+
+            # handed over by release, its last job may just have crashed or hung it
+            if worker is not None and await self._check(worker):
+                return worker
+
+    @log_decorator("acquiring a browser")
+    async def acquire(self, affinity: Hashable = None) -> BrowserWorker:
+        """
+        A healthy browser. With an affinity, an idle browser that recently ran a job with the same affinity is
+        preferred, e.g. because it still has the page of that job open.
+        """
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+        options = _job_options.get()
+
+        started = time.perf_counter()
+        worker = await self._get(options, affinity)
+
+        if affinity is not None:
+            worker.affinities[affinity] = None
+            worker.affinities.move_to_end(affinity)
+            while len(worker.affinities) > WARM_TABS:
+                worker.affinities.popitem(last=False)
+
+        self.wait_times.append(time.perf_counter() - started)
+        self.counters["leases"] += 1
+        self.counters[f"leases_{options.priority.name.lower()}"] += 1
+        self.leased.add(worker)
+        return worker
+
+    @log_decorator("releasing a browser")
+    def release(self, worker: BrowserWorker):
+        self.leased.discard(worker)
+        worker.uses += 1
+        worker.last_used = time.monotonic()
+
+        if worker.uses >= MAX_USES:
+            self._discard(worker, "uses")
+        elif (rss := worker.get_rss()) is not None and rss > MAX_RSS:
+            self._discard(worker, "rss")
+        else:
+            self._hand_over(worker)
+            return
+
+        self._hand_over(None)
+
+    def get_stats(self) -> dict:
+        wait_times = sorted(self.wait_times)
 
-    @log_decorator("releasing browser lock")
-    def release(self, webdriver: WebDriver):
-        for i, (web_driver, is_free) in enumerate(self.browsers):
-            if web_driver == webdriver:
-                self.browsers[i][1] = True
-                break
+        def percentile(percent: float) -> Union[float, None]:
+            if not wait_times:
+                return None
+            return wait_times[min(len(wait_times) - 1, int(len(wait_times) * percent / 100))] * 1000
 
-        self.semaphore.release()
+        return {"size": self.size,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "leased": len(self.leased),
+                "idle": len(self.idle),
+                "waiting": {priority.name.lower(): sum(len(waiters) for waiters in self.waiters[priority].values())
+                            for priority in Priority},
+                "occupancy": len(self.leased) / self.max_size,
+                "wait_p50_ms": percentile(50),
+                "wait_p95_ms": percentile(95),
+                "wait_max_ms": None if not wait_times else wait_times[-1] * 1000,
+                "rss": {worker.name: worker.get_rss() for worker in [*self.idle, *self.leased]},
+                "affinities": sum(len(worker.affinities) for worker in [*self.idle, *self.leased]),
+                **self.counters}
 
 
-wbq: Union[WebBrowserQueue, None] = None
+pool: Union[BrowserPool, None] = None
 
 
 def prepare():
-    global wbq
-    if wbq is None:
-        wbq = WebBrowserQueue(5)
+    """Creates the pool, the browsers themselves are only started when a job needs one."""
+    global pool
+    if pool is None:
+        pool = BrowserPool(MIN_BROWSERS, MAX_BROWSERS)
+
+
+def get_pool_stats() -> Union[dict, None]:
+    return None if pool is None else pool.get_stats()
 
 
 # warten bis irgendein browser thread das lock löst
@@ -65,55 +547,108 @@ def zoom(webdriver: WebDriver, factor: float = 1):
     webdriver.execute_script(f"document.body.style.zoom='{factor}'")
 
 
-def _async_thread_wrapper(event: Event, func: Callable):
-    result = func()
-    event.set()
+def _execute(webdriver: WebDriver, func: Callable, size: Union[tuple[int, int], None] = (1600, 900),
+             scale: Union[float, None] = 1):
+    # None leaves the browser as it is, for jobs that keep a prepared page
+    if size is not None:
+        log("Setting window size")
+        width, height = size
+        webdriver.set_window_size(width, height)
+
+    if scale is not None:
+        log("Scaling")
+        webdriver.execute_script(f"document.body.style.zoom='{scale}'")
+
+    # call function
+    return func(webdriver)
+
+
+async def run_function(func: Callable, size: Union[tuple[int, int], None] = (1600, 900),
+                       scale: Union[float, None] = 1, postprocess: Callable = None, affinity: Hashable = None):
+    """
+    Runs func(webdriver) on a pooled browser. postprocess(result) runs with run_cpu after the browser was released,
+    browser jobs should leave their image work to it. affinity is passed on to BrowserPool.acquire.
+    """
+    prepare()
+    worker = await pool.acquire(affinity)
+
+    if (deadline := _job_options.get().deadline) is not None and time.monotonic() > deadline:
+        pool.release(worker)
+        raise DeadlineExceeded("The job's deadline passed while it was waiting for a browser.")
+
+    log("handing control to the browser's thread")
+    future = worker.submit(functools.partial(_execute, func=func, size=size, scale=scale))
+    try:
+        # a cancelled caller doesn't stop the job, the browser is only free again once it is done
+        result = await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(lambda _: pool.release(worker))
+        raise
+    except BaseException:
+        # failed jobs return their browser too, or it is lost to the pool for good
+        pool.release(worker)
+        raise
+    else:
+        pool.release(worker)
+
+    if postprocess is not None:
+        with log("Post-processing without the browser"):
+            result = await run_cpu(postprocess, result)
     return result
 
 
-def set_logger(logger: Logger, nlist: list[int]):
-    loggerstack_contextvar.set([logger])
-    nlist_contextvar.set(nlist[:])
+cpu_workers: list[ProcessWorker] = []
 
 
-async def async_thread_wrapper(func: Callable):
-    # start a thread
-    pool = ThreadPool(processes=1, initializer=set_logger, initargs=(get_current_logger(), get_current_nlist()))
+async def run_cpu(func: Callable, *args, **kwargs):
+    """
+    Runs CPU heavy work like Pillow encoding off the event loop: in a worker process with PROCESS_WORKERS (func and
+    the arguments have to be picklable), otherwise in a thread.
+    """
+    job = functools.partial(func, *args, **kwargs)
 
-    # create an event
-    event = Event()
+    if not PROCESS_WORKERS:
+        return await asyncio.get_running_loop().run_in_executor(None, job)
 
-    async_result = pool.apply_async(_async_thread_wrapper, (event, func))
+    # replace crashed workers, then take the one with the fewest queued jobs
+    cpu_workers[:] = [worker for worker in cpu_workers
+                      if worker.thread.is_alive() and (worker.process is None or worker.process.poll() is None)]
+    while len(cpu_workers) < CPU_WORKERS:
+        cpu_workers.append(ProcessWorker(f"cpu-{len(cpu_workers)}", with_browser=False))
 
-    # wait for finish using an event
-    await event.wait()
+    worker = min(cpu_workers, key=lambda worker_: worker_.jobs.qsize())
+    await asyncio.wrap_future(worker.ready)
+    return await worker.submit(job)
 
-    return async_result.get()
 
+# operation -> counts of requests and of browser leases that were actually taken
+dispatch_stats: dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
 
-def _execute(webdriver: WebDriver, func: Callable, size: tuple[int, int] = (1600, 900), scale: float = 1):
-    # set window size
-    log("Setting window size")
-    width, height = size
-    webdriver.set_window_size(width, height)
 
-    # set scale
-    log("Scaling")
-    webdriver.execute_script(f"document.body.style.zoom='{scale}'")
+def get_dispatch_stats() -> dict[str, dict[str, int]]:
+    out = {}
+    for operation, counter in dispatch_stats.items():
+        out[operation] = {"requests": counter["requests"],
+                          "leases": counter["leases"],
+                          "leases_avoided": max(0, counter["requests"] - counter["leases"])}
+    return out
 
-    # call function
-    return func(webdriver)
 
+async def run_cached(operation: str, hash_obj, func: Callable[[WebDriver], object],
+                     size: Union[tuple[int, int], None] = (1600, 900), scale: Union[float, None] = 1,
+                     postprocess: Callable[[object], bytes] = None, affinity: Hashable = None) -> bytes:
+    """
+    Like run_function, but looks in the cache before waiting for a browser and saves the result afterwards.
+    Concurrent calls with the same hash_obj share one browser job, stale entries are refreshed in the background.
+    """
+    dispatch_stats[operation]["requests"] += 1
 
-async def run_function(func: Callable, size: tuple[int, int] = (1600, 900), scale: float = 1):
-    if not wbq:
-        # raise Exception("WebBrowserQueue not created, call the prepare() method first.")
-        prepare()
-    driver = await wbq.aquire()
+    async def render():
+        dispatch_stats[operation]["leases"] += 1
+        if cachelib.refreshing.get():
+            # nobody is waiting for a background refresh
+            with job_options(Priority.BULK, _job_options.get().owner):
+                return await run_function(func, size, scale, postprocess, affinity)
+        return await run_function(func, size, scale, postprocess, affinity)
 
-    log("handing control to async selenium thread")
-    try:
-        result = await async_thread_wrapper(lambda: _execute(driver, func, size, scale))
-    finally:
-        wbq.release(driver)
-    return result
+    return await cachelib.cached(hash_obj, render)
@@ -1,16 +1,24 @@
 from selenium.webdriver.chrome.webdriver import WebDriver
+import functools
+import os
 import pickle
 import discord
 from io import BytesIO
+from typing import Iterable
 
+import cachelib
+import dictionary_card
 import seleniumutil
 import google_dictionary
+import phonetic_index
 from context_logger import log_decorator
 from belissibot_framework import BotError
 
 DICT_PREFIX = "dictionaries/"
 
-seleniumutil.prepare()
+# how cards are rendered: "browser" screenshots Google's dictionary card, "pillow" draws it with dictionary_card
+CARD_ENGINES = ("browser", "pillow")
+CARD_ENGINE = os.environ.get("BELISSIBOT_CARD_ENGINE", "browser")
 
 
 def split_word(word: str, chars=".·*") -> list[str]:
@@ -64,15 +72,30 @@ class Word:
         return f"!wörterbuch render {self.get_display_name()!r} {self.ipa!r} {self.part_of_speech!r} " \
                f"{self.meaning!r} {self.example!r}"
 
-    @log_decorator("Getting DC File")
-    async def get_dc_file(self, filename: str = "image.png"):
+    async def get_card(self, engine: str = None) -> bytes:
+        engine = CARD_ENGINE if engine is None else engine
         display_name = self.get_display_name()
-        bytes_arr = await seleniumutil.run_function(
-            lambda webdriver: google_dictionary.get_image(webdriver,
-                                                          display_name, self.ipa, self.part_of_speech, self.meaning,
-                                                          self.example)
+
+        if engine == "pillow":
+            hash_obj = dictionary_card.get_hash_obj(display_name, self.ipa, self.part_of_speech, self.meaning,
+                                                    self.example)
+            return await cachelib.cached(hash_obj, lambda: seleniumutil.run_cpu(dictionary_card.render, self))
+
+        if engine != "browser":
+            raise BotError(f"Unknown card engine {engine!r}, possible values: {', '.join(CARD_ENGINES)}")
+
+        hash_obj = google_dictionary.get_hash_obj(display_name, self.ipa, self.part_of_speech, self.meaning,
+                                                  self.example)
+        return await seleniumutil.run_cached(
+            "dictionary", hash_obj,
+            functools.partial(google_dictionary.capture, word=display_name, ipa=self.ipa,
+                              part_of_speech=self.part_of_speech, meaning=self.meaning, example=self.example),
+            size=None, scale=None, postprocess=google_dictionary.postprocess
         )
-        stream = BytesIO(bytes_arr)
+
+    @log_decorator("Getting DC File")
+    async def get_dc_file(self, filename: str = "image.png"):
+        stream = BytesIO(await self.get_card())
         return discord.File(stream, filename=filename)
 
     @log_decorator("Getting DC Embed")
@@ -98,6 +121,7 @@ class Dictionary:
     def __init__(self, name: str, data: dict = None):
         self._name = name
         self._data: dict[str: Word] = {} if data is None else data
+        self.phonetic_index = phonetic_index.PhoneticIndex.build((key, word.ipa) for key, word in self._data.items())
 
         self.save()
 
@@ -114,10 +138,12 @@ class Dictionary:
 
     def add_word(self, word: Word):
         self._data.update({word.get_data_key(): word})
+        self.phonetic_index.add(word.get_data_key(), word.ipa)
         self.save()
 
     def remove_word(self, word: str):
         del self._data[word]
+        self.phonetic_index.remove(word)
         self.save()
 
     def search_word(self, query: str) -> list[Word]:
@@ -132,6 +158,17 @@ class Dictionary:
                     out.append(word)
             return out
 
+    def _get_words(self, keys: Iterable[str], exclude: str = None) -> list[Word]:
+        return sorted((self._data[key] for key in keys if key != exclude), key=lambda word: word.get_data_key())
+
+    def find_rhymes(self, ipa: str, exclude: str = None) -> tuple[list[Word], list[Word]]:
+        """(words rhyming from the last stressed syllable on, words only sharing the last syllable)"""
+        full, final = self.phonetic_index.rhymes(ipa)
+        return self._get_words(full, exclude), self._get_words((key for key in final if key not in full), exclude)
+
+    def find_near_homophones(self, ipa: str, exclude: str = None) -> list[Word]:
+        return self._get_words(self.phonetic_index.near_homophones(ipa), exclude)
+
     def __iter__(self):
         return iter(self._data.values())
 
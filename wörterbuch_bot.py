@@ -1,14 +1,18 @@
 import asyncio
 import io
+import json
 import os
 from typing import Literal
 
 import discord
 
+import cachelib
 import font_selection
 import g2p
+import phonetic_index
 import postermywall
 import postermywall as pmw
+import seleniumutil
 import wörterbuch
 from belissibot_framework import App, construct_help_embed, BotError
 
@@ -22,6 +26,11 @@ else:
 bot_app = App()
 
 
+def browser_jobs(message: discord.Message, priority: seleniumutil.Priority = seleniumutil.Priority.INTERACTIVE):
+    """Browser jobs of a command take turns with those of other channels and users."""
+    return seleniumutil.job_options(priority, owner=(message.channel.id, message.author.id))
+
+
 def get_wb_help(name: str, description: str):
     return construct_help_embed(
         f"!wörterbuch {name}",
@@ -52,19 +61,117 @@ async def testest(client: discord.Client, message: discord.Message):
              "!wörterbuch search help",
              "!wörterbuch list help",
              "!wörterbuch remove help",
+             "!wörterbuch rhyme help",
              "!g2p help",
              "!postermywall render help",
+             "!postermywall variants help",
              "!postermywall attrs help",
              "!postermywall search help",
+             "!postermywall invalidate help",
              "!poll new help",
              "!poll choice help",
              "!poll remove help",
              "!poll publish help",
+             "!belissibot cache help",
+             "!belissibot browsers help",
              "!belissibot fullhelp help"]
 
     await asyncio.gather(*[message.channel.send(help_) for help_ in helps])
 
 
+def format_ms(value: float | None) -> str:
+    return "-" if value is None else f"{value:.1f}ms"
+
+
+@bot_app.add_help("!belissibot cache",
+                  "Shows how well the render cache works: hits, misses, transferred bytes and lookup latencies per "
+                  "key namespace, evictions per tier and how many browser leases were avoided.",
+                  "!belissibot cache",
+                  argstr="[json]",
+                  json="Sends the raw numbers as a json file instead. Optional.")
+@bot_app.route("!belissibot cache", delete_message=False, raw_args=True)
+async def belissibot_cache(client: discord.Client, message: discord.Message, raw_args: str = ""):
+    stats = cachelib.get_stats()
+    stats["dispatch"] = seleniumutil.get_dispatch_stats()
+
+    if "json" in raw_args.lower().split(" "):
+        file = discord.File(io.BytesIO(json.dumps(stats, indent=2).encode()), filename="cache_stats.json")
+        await message.reply(file=file)
+        return
+
+    out = discord.Embed(title="Cache Statistics", color=discord.Color(0x00FF00))
+
+    for name, namespace in sorted(stats["namespaces"].items()):
+        hit_rate = "-" if namespace["hit_rate"] is None else f"{namespace['hit_rate']:.1%}"
+        out.add_field(name=f"`{name}`",
+                      value=f"hits: `{namespace['hits']:_}` (stale: `{namespace['stale_hits']:_}`)\n"
+                            f"misses: `{namespace['misses']:_}`\n"
+                            f"hit rate: `{hit_rate}`\n"
+                            f"read: `{namespace['bytes_read']:_}` B\n"
+                            f"written: `{namespace['bytes_written']:_}` B\n"
+                            f"p50/p95: `{format_ms(namespace['p50_ms'])}`/`{format_ms(namespace['p95_ms'])}`")
+
+    for name, tier in stats.get("tiers", {}).items():
+        out.add_field(name=f"{name} tier",
+                      value=f"hits: `{tier['hits']:_}`\n"
+                            f"evictions: `{tier['evictions']:_}`\n"
+                            f"size: `{tier['size']:_}`/`{tier['budget']:_}` B")
+
+    if stats["dispatch"]:
+        out.add_field(name="Browser leases avoided", inline=False,
+                      value="\n".join([f"`{operation}`: `{dispatch['leases_avoided']:_}` of "
+                                       f"`{dispatch['requests']:_}` requests"
+                                       for operation, dispatch in sorted(stats["dispatch"].items())]))
+
+    await message.reply(embed=out)
+
+
+@bot_app.add_help("!belissibot browsers",
+                  "Shows the browser pool: running and leased browsers, how long jobs waited for one, why "
+                  "browsers were replaced and how often PosterMyWall renders found their template already open.",
+                  "!belissibot browsers")
+@bot_app.route("!belissibot browsers", delete_message=False)
+async def belissibot_browsers(client: discord.Client, message: discord.Message):
+    if (stats := seleniumutil.get_pool_stats()) is None:
+        await message.reply(embed=discord.Embed(description="No browser has been needed yet. 😴"))
+        return
+
+    out = discord.Embed(title="Browser Pool", color=discord.Color(0x00FF00))
+    out.add_field(name="Browsers",
+                  value=f"running: `{stats['size']}` (`{stats['min_size']}`-`{stats['max_size']}`)\n"
+                        f"leased: `{stats['leased']}`\n"
+                        f"idle: `{stats['idle']}`\n"
+                        f"occupancy: `{stats['occupancy']:.0%}`")
+    out.add_field(name="Leases",
+                  value=f"total: `{stats.get('leases', 0):_}`\n"
+                        f"waiting: `{stats['waiting']['interactive']}` interactive, "
+                        f"`{stats['waiting']['bulk']}` bulk\n"
+                        f"wait p50/p95: `{format_ms(stats['wait_p50_ms'])}`/`{format_ms(stats['wait_p95_ms'])}`\n"
+                        f"wait max: `{format_ms(stats['wait_max_ms'])}`")
+    out.add_field(name="Lifecycle",
+                  value=f"launched: `{stats.get('launches', 0):_}`\n" + "\n".join(
+                      f"{reason}: `{stats.get(f'recycled_{reason}', 0):_}`"
+                      for reason in ("uses", "rss", "unhealthy", "idle")))
+    out.add_field(name="Dropped",
+                  value=f"deadline: `{stats.get('deadline_exceeded', 0):_}`\n"
+                        f"cancelled: `{stats.get('cancelled_queued', 0):_}`")
+    tab_stats = pmw.get_tab_stats()
+    affinity_requests = stats.get("affinity_hits", 0) + stats.get("affinity_misses", 0)
+    hit_rate = "-" if tab_stats["hit_rate"] is None else f"{tab_stats['hit_rate']:.1%}"
+    out.add_field(name="PosterMyWall tabs",
+                  value=f"routed to a warm browser: `{stats.get('affinity_hits', 0):_}`/`{affinity_requests:_}`\n"
+                        f"hit rate: `{hit_rate}`\n"
+                        f"open: `{tab_stats['tabs']}`, `{tab_stats['memory'] / 1024 ** 2:.0f}` MiB js heap\n"
+                        f"resets: `{tab_stats.get('resets', 0):_}`\n"
+                        f"evictions: `{tab_stats.get('evictions', 0):_}`")
+    if rss := {name: value for name, value in stats["rss"].items() if value is not None}:
+        out.add_field(name="Memory", inline=False,
+                      value="\n".join(f"`{name}`: `{value / 1024 ** 2:.0f}` MiB"
+                                       for name, value in sorted(rss.items())))
+
+    await message.reply(embed=out)
+
+
 @bot_app.add_help("!postermywall render",
                   "Renders a template with the given changes",
                   '!postermywall render "5a72a3a166d55ebea89d03ebceb1de05" [([2, 1], "This is modified!"), ([7, 1], "50'
@@ -81,10 +188,34 @@ async def postermywall_render(client: discord.Client, message: discord.Message,
                         description=f"command: `!postermywall render "
                                     f"{template_id!r} {changes!r}`")
     out.set_image(url="attachment://image.png")
-    file = await template.get_dc_modify_file(changes)
+    with browser_jobs(message):
+        file = await template.get_dc_modify_file(changes)
     await message.channel.send(embed=out, file=file)
 
 
+# attachments discord allows per message
+MAX_VARIANTS = 10
+
+
+@bot_app.add_help("!postermywall variants",
+                  f"Renders a template once per list of changes, e.g. with different names or dates. At most "
+                  f"{MAX_VARIANTS} variants.",
+                  '!postermywall variants "5a72a3a166d55ebea89d03ebceb1de05" [[([2, 1], "Anna")], [([2, 1], "Ben")]]',
+                  template_id="The template id obtained by `!postermywall search`.",
+                  variants="Of the type ```py\nlist[list[tuple[list[int], str]]]```\nOne list of changes like the "
+                           "ones of `!postermywall render` per image.")
+@bot_app.route("!postermywall variants", do_log=True, delete_message=False)
+async def postermywall_variants(client: discord.Client, message: discord.Message, template_id: str, variants):
+    if not 0 < len(variants) <= MAX_VARIANTS:
+        raise BotError(f"Give between 1 and {MAX_VARIANTS} variants, not {len(variants)}.")
+
+    template = await pmw.Template.from_id(template_id)
+
+    with browser_jobs(message):
+        files = await template.get_dc_variant_files(variants)
+    await message.channel.send(embed=discord.Embed(title=f"{len(files)} Variants of `{template_id}`"), files=files)
+
+
 @bot_app.add_help("!postermywall attrs",
                   "Shows all modifyable elemements with their respective path given a template id.",
                   "!postermywall attrs \"5a72a3a166d55ebea89d03ebceb1de05\"",
@@ -92,7 +223,23 @@ async def postermywall_render(client: discord.Client, message: discord.Message,
 @bot_app.route("!postermywall attrs", do_log=True, delete_message=False)
 async def postermywall_attrs(client: discord.Client, message: discord.Message, template_id: str):
     template = await pmw.Template.from_id(template_id)
-    await message.channel.send(embed=await template.get_dc_attrs_embed(), file=await template.get_dc_file(message))
+    with browser_jobs(message):
+        embed = await template.get_dc_attrs_embed()
+    await message.channel.send(embed=embed, file=await template.get_dc_file(message))
+
+
+@bot_app.add_help("!postermywall invalidate",
+                  "Forgets the cached preview, attributes and renders of a template, e.g. after it was changed on "
+                  "PosterMyWall. Can only be used by `Belissimo#1438`.",
+                  "!postermywall invalidate \"5a72a3a166d55ebea89d03ebceb1de05\"",
+                  template_id="The template id obtained by `!postermywall search`.")
+@bot_app.route("!postermywall invalidate", only_from_users=[311516082320048128])
+async def postermywall_invalidate(client: discord.Client, message: discord.Message, template_id: str):
+    template = await pmw.Template.from_id(template_id)
+    template.invalidate_cache()
+
+    await message.channel.send(embed=discord.Embed(color=discord.Color(0x00FF00),
+                                                   description=f"Cache of `{template_id}` invalidated. ✅"))
 
 
 async def send_template(message: discord.Message, template: pmw.Template):
@@ -127,7 +274,7 @@ async def postermywall_search(client: discord.Client, message: discord.Message,
 async def zitat(client: discord.Client, message: discord.Message, text: str, author: str):
     background = get_image()
     for _ in range(5):
-        img = io.BytesIO(get_zitat(text, author, background))
+        img = io.BytesIO(await seleniumutil.run_cpu(get_zitat, text, author, background))
 
         file = discord.File(img, filename="zitat.png")
         await message.channel.send("pure inspiration.", file=file)
@@ -222,6 +369,8 @@ async def wb(client: discord.Client, message: discord.Message, _=""):
                          inline=False)
     help_embed.add_field(name="`!wörterbuch list`", value="Shows all words in the dictionary.", inline=False)
     help_embed.add_field(name="`!wörterbuch remove`", value="Removes a word from the dictionary.", inline=False)
+    help_embed.add_field(name="`!wörterbuch rhyme`", value="Finds rhymes and similar sounding words in the "
+                                                          "dictionary.", inline=False)
 
     help_embed.add_field(name="`!g2p`", value="Grapheme to Phoneme: Helps getting the ipa string.", inline=False)
 
@@ -239,7 +388,8 @@ async def wb_render(client: discord.Client, message: discord.Message, word_, ipa
     word = wörterbuch.Word(wörterbuch.split_word(word_), ipa, part_of_speech,
                            meaning, example)
 
-    embed, file = await word.get_dc_embed()
+    with browser_jobs(message):
+        embed, file = await word.get_dc_embed()
     await message.channel.send(file=file, embed=embed)
 
 
@@ -255,7 +405,8 @@ async def wb_add(client: discord.Client, message: discord.Message, word_, ipa, p
 
     dictionary.add_word(word)
 
-    embed, file = await word.get_dc_embed("Added word to dictionary ✅")
+    with browser_jobs(message):
+        embed, file = await word.get_dc_embed("Added word to dictionary ✅")
     await message.channel.send(file=file, embed=embed)
 
 
@@ -293,8 +444,10 @@ async def wb_list(client: discord.Client, message: discord.Message):
         word: wörterbuch.Word
         embed = discord.Embed(title=word.get_display_name())
         embed.set_image(url="attachment://image.png")
-        await message.channel.send("temporary message, gets auto-deleted after 2 min", embed=embed,
-                                   file=await word.get_dc_file(),
+        # one render per word, interactive commands go first
+        with browser_jobs(message, seleniumutil.Priority.BULK):
+            file = await word.get_dc_file()
+        await message.channel.send("temporary message, gets auto-deleted after 2 min", embed=embed, file=file,
                                    delete_after=2 * 60)
 
 
@@ -307,7 +460,8 @@ async def wb_search(client: discord.Client, message: discord.Message, search_que
     results = dictionary.search_word(search_query)
 
     for i, word in enumerate(results):
-        embed, file = await word.get_dc_embed(f"Search result #{i + 1}")
+        with browser_jobs(message):
+            embed, file = await word.get_dc_embed(f"Search result #{i + 1}")
         await message.channel.send(file=file, embed=embed)
 
     if len(results) == 0:
@@ -316,6 +470,43 @@ async def wb_search(client: discord.Client, message: discord.Message, search_que
         await message.channel.send(embed=embed)
 
 
+def join_words(words: list[wörterbuch.Word], limit: int = 1024) -> str:
+    out = ""
+    for i, word in enumerate(words):
+        item = f"`{word.get_display_name()}`"
+        if len(out) + len(item) + 20 > limit:
+            return out + f"and {len(words) - i} more"
+        out += item + ", "
+    return out.removesuffix(", ") or "-"
+
+
+@bot_app.add_help("!wörterbuch rhyme",
+                  "Finds words in the dictionary that rhyme with or sound similar to a word.",
+                  "!wörterbuch rhyme \"reinjoinen\"",
+                  query="A word of the dictionary (exact match), a German word, or a phonetic transcription.")
+@bot_app.route("!wörterbuch rhyme", delete_message=False)
+async def wb_rhyme(client: discord.Client, message: discord.Message, query: str):
+    if (results := dictionary.search_word(query)) and results[0].get_data_key() == query:
+        ipa = results[0].ipa
+    elif any(char in phonetic_index.PHONEME_CLASSES and not char.isascii() for char in query):
+        ipa = query
+    else:
+        ipa = "".join(await g2p.transcribe(query, "deu")).replace("_", "")
+
+    syllables = phonetic_index.syllabify(ipa)
+    rhymes, final_rhymes = dictionary.find_rhymes(ipa, exclude=query)
+    homophones = dictionary.find_near_homophones(ipa, exclude=query)
+
+    out = discord.Embed(title=f"Rhymes of `{query}`", color=discord.Color(0x00FF00),
+                        description=f"ipa: `{'.'.join(map(str, syllables))}`\n"
+                                    f"rhyme: `{phonetic_index.rhyme_key(syllables)}`")
+    out.add_field(name="Rhymes", value=join_words(rhymes), inline=False)
+    out.add_field(name="Last syllable rhymes", value=join_words(final_rhymes), inline=False)
+    out.add_field(name="Sounds similar", value=join_words(homophones), inline=False)
+
+    await message.channel.send(embed=out)
+
+
 @bot_app.route("!g2p help")
 async def g2p_help(client: discord.Client, message: discord.Message):
     help_embed = discord.Embed(title="Usage of `!g2p`",
@@ -337,14 +528,16 @@ async def g2p_help(client: discord.Client, message: discord.Message):
                                "netik.uni-muenchen.de/BASWebServices/help/termsOfUsage#termsofusage). It states "
                                "that the usage of this API is for **academic (non-profit research) use only** and "
                                "the user **must be part of an academic institution**.\n**Do not spam** "
-                               "and **don't give away any private information**.", inline=False)
+                               "and **don't give away any private information**.\nGerman (`deu`) words are "
+                               "transcribed locally where possible and only sent to the API if that fails.",
+                         inline=False)
 
     await message.channel.send(embed=help_embed)
 
 
 @bot_app.route("!g2p")
 async def g2p_(client: discord.Client, message: discord.Message, _word, lang):
-    phonemes = g2p.g2p(_word, lang)
+    phonemes = await g2p.transcribe(_word, lang)
 
     p_phon_syllables, p_word_syllables = g2p.get_syllables(phonemes, _word)
     word = wörterbuch.Word(p_word_syllables, "".join(phonemes).replace("+", "").replace("_", ""), "", "",